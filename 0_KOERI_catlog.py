@@ -1,10 +1,10 @@
 
 import pandas as pd
-from datetime import datetime, timedelta
-import csv
+from datetime import timedelta
 import time
 import re
-from shapely.geometry import Point, Polygon
+from shapely.geometry import Polygon
+from catlog_utils import convert_csv_to_custom_format, points_in_polygons, write_catlog_npy
 
 # Read the data using tab as the separator
 data = pd.read_csv(
@@ -39,14 +39,13 @@ polygon_coords = [
 
 polygon = Polygon(polygon_coords)
 
-# Function to check if a point is within the polygon
-def is_within_polygon(row):
-    point = Point(row['Longitude'], row['Latitude'])
-    return polygon.contains(point)
-
 # Filter data based on geographical, magnitude, and depth criteria
+# The polygon test runs on the whole Longitude/Latitude columns at once;
+# a list of polygons or a MultiPolygon can be passed as well
 CAP_seismicity_updated = CAP_seismicity_updated[
-    (CAP_seismicity_updated.apply(is_within_polygon, axis=1)) &
+    points_in_polygons(
+        CAP_seismicity_updated["Longitude"], CAP_seismicity_updated["Latitude"], polygon
+    ) &
     (CAP_seismicity_updated["Magnitude"] >= 1.5) &
     (CAP_seismicity_updated["Magnitude"] <= 3.5) &
     (CAP_seismicity_updated["Depth"] <= 20.0) &
@@ -90,51 +89,6 @@ class Event:
             )
         )
 
-def convert_csv_to_custom_format(input_file, output_file):
-    data = []
-    with open(input_file, "r", encoding="utf-8") as infile:
-        csvreader = csv.reader(infile)
-        next(csvreader)  # Skip headers in the input CSV
-
-        events = []
-        for row in csvreader:
-            time_str, lat, lon, depth, magnitude, mag_type = row
-            try:
-                time_obj = datetime.strptime(time_str, "%Y-%m-%dT%H:%M:%S.%fZ")
-                events.append((time_obj, row))
-            except ValueError as e:
-                print(f"Time format error for row: {row}, error: {e}")
-                continue
-
-    events.sort(key=lambda x: x[0])
-
-    last_kept_time = None
-    for time_obj, row in events:
-        if last_kept_time is None or (time_obj - last_kept_time) >= timedelta(minutes=5):
-            time_str, lat, lon, depth, magnitude, mag_type = row
-            new_time_str = time_obj.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-            output_row = [
-                "xxxxx",
-                new_time_str,
-                lat,
-                lon,
-                depth,
-                "xxxx",
-                "yyyyy",
-                mag_type,
-                magnitude,
-                " ",
-            ]
-            data.append((time_obj, output_row))
-            last_kept_time = time_obj
-
-    data.sort(key=lambda x: x[0], reverse=True)
-
-    with open(output_file, "w", newline="", encoding="utf-8") as outfile:
-        csvwriter = csv.writer(outfile)
-        for _, output_row in data:
-            csvwriter.writerow(output_row)
-
 def parse_custom_format(input_file, output_file):
     with open(input_file, "r") as el:
         evps = el.read().splitlines()
@@ -188,6 +142,9 @@ output_par = "catlog/KOERI_catlog.par"
 
 # Save the final data as a CSV file, using comma as separator
 CAP_seismicity_updated.to_csv(output_csv, index=False, sep=",")
-convert_csv_to_custom_format(output_csv, output_txt)
+# Keep events at least 5 minutes apart
+convert_csv_to_custom_format(output_csv, output_txt, min_gap=timedelta(minutes=5))
 parse_custom_format(output_txt, output_par)
+# Typed binary twin of the .par (catlog/KOERI_catlog.npy) read by the later steps
+write_catlog_npy(output_par)
 print("Data processing completed.")
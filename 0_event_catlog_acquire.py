@@ -4,13 +4,20 @@
 # from 2013 to 2015  
 ###############################################################################  
 
+from obspy import Catalog, read_events  
 from obspy.clients.fdsn import Client  
+from obspy.clients.fdsn.header import FDSNNoDataException  
+from concurrent.futures import ThreadPoolExecutor  
 import pandas as pd  
-import csv  
+import argparse  
 from datetime import datetime, timedelta  
+import hashlib  
+import os  
 import re  
+import threading  
 import time  
 from dateutil.relativedelta import relativedelta  
+from catlog_utils import convert_csv_to_custom_format, write_catlog_npy  
 
 ###############################################################################  
 
@@ -49,19 +56,101 @@ class Event:
             )  
         )  
 
-def fetch_events(client, minlat, maxlat, minlon, maxlon, stime, etime):  
+MINMAG = 2.1  # Minimum magnitude for events  
+MAXMAG = 3.5  # Maximum magnitude for events  
+MAXDEPTH = 30.0  # Maximum depth for events in km  
+
+def fetch_events(client, minlat, maxlat, minlon, maxlon, stime, etime,  
+                 minmag=MINMAG, maxmag=MAXMAG, maxdepth=MAXDEPTH):  
     # Fetch seismic events from the FDSN web services  
-    return client.get_events(  
-        minlatitude=minlat,  
-        maxlatitude=maxlat,  
-        minlongitude=minlon,  
-        maxlongitude=maxlon,  
-        starttime=stime,  
-        endtime=etime,  
-        minmagnitude=2.1,  # Minimum magnitude for events  
-        maxmagnitude=3.5,  # Maximum magnitude for events  
-        maxdepth=30.0,  # Maximum depth for events in km  
+    try:  
+        return client.get_events(  
+            minlatitude=minlat,  
+            maxlatitude=maxlat,  
+            minlongitude=minlon,  
+            maxlongitude=maxlon,  
+            starttime=stime,  
+            endtime=etime,  
+            minmagnitude=minmag,  
+            maxmagnitude=maxmag,  
+            maxdepth=maxdepth,  
+        )  
+    except FDSNNoDataException:  
+        # HTTP 204: no event in this window  
+        return Catalog()  
+
+def window_cache_path(cache_dir, provider, bounds, limits, stime, etime):  
+    # Cache file for one time window, keyed by every parameter of the request  
+    # bounds = (minlat, maxlat, minlon, maxlon); limits = (minmag, maxmag, maxdepth)  
+    key = "|".join(str(x) for x in (provider, *bounds, *limits, stime, etime))  
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]  
+    tag = re.sub(r"[^A-Za-z0-9]+", "_", provider).strip("_")  
+    return os.path.join(  
+        cache_dir, f"{tag}_{stime:%Y%m%dT%H%M%S}_{etime:%Y%m%dT%H%M%S}_{digest}.xml"  
+    )  
+
+def is_window_open(etime, settle_days=7):  
+    # A window is still open if it ends in the future or so recently that the  
+    # agency may still add or revise events; such windows are always refetched  
+    return etime > datetime.utcnow() - timedelta(days=settle_days)  
+
+def fetch_window_cached(get_client, provider, bounds, limits, stime, etime,  
+                        cache_dir, refresh=False):  
+    # Fetch one time window, serving closed windows from the on-disk cache  
+    path = window_cache_path(cache_dir, provider, bounds, limits, stime, etime)  
+    window_open = is_window_open(etime)  
+    if os.path.exists(path) and not (refresh or window_open):  
+        return read_events(path, format="QUAKEML"), True  
+
+    events = fetch_events(  
+        get_client(),  
+        *bounds,  
+        stime.strftime("%Y-%m-%d %H:%M:%S"),  
+        etime.strftime("%Y-%m-%d %H:%M:%S"),  
+        *limits,  
     )  
+    if not window_open:  
+        # Write then rename so an interrupted run never leaves a partial file  
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"  
+        events.write(tmp_path, format="QUAKEML")  
+        os.replace(tmp_path, path)  
+    return events, False  
+
+def monthly_windows(start_date, end_date):  
+    # Split [start_date, end_date) into calendar-month windows  
+    windows = []  
+    current_date = start_date  
+    while current_date < end_date:  
+        next_month = current_date + relativedelta(months=1)  
+        windows.append((current_date, next_month))  
+        current_date = next_month  
+    return windows  
+
+def fetch_all_windows(provider, bounds, limits, windows, cache_dir,  
+                      workers=4, refresh=False):  
+    # Fetch all windows with a bounded thread pool; results keep window order  
+    os.makedirs(cache_dir, exist_ok=True)  
+    local = threading.local()  
+
+    def get_client():  
+        # One client per worker thread, reused for all of its windows  
+        if not hasattr(local, "client"):  
+            local.client = Client(provider)  
+        return local.client  
+
+    def fetch(window):  
+        stime, etime = window  
+        return fetch_window_cached(  
+            get_client, provider, bounds, limits, stime, etime, cache_dir, refresh  
+        )  
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:  
+        results = list(executor.map(fetch, windows))  
+
+    n_cached = sum(1 for _, cached in results if cached)  
+    print(f"{len(windows)} windows: {n_cached} from cache, "  
+          f"{len(windows) - n_cached} fetched from {provider}")  
+    return [events for events, _ in results]  
 
 def save_events_to_csv(events_list, csv_file):  
     # Save event details to a CSV file  
@@ -94,56 +183,6 @@ def save_events_to_csv(events_list, csv_file):
     )  
     df.to_csv(csv_file, index=False)  # Save DataFrame to a CSV file without indices  
 
-def convert_csv_to_custom_format(input_file, output_file):  
-    # Convert the CSV file to a custom output format with correct time filtering  
-    data = []  
-    with open(input_file, "r", encoding="utf-8") as infile:  
-        csvreader = csv.reader(infile)  
-        next(csvreader)  # Skip headers in the input CSV  
-
-        events = []  
-        for row in csvreader:  
-            time_str, lat, lon, depth, magnitude, mag_type = row  
-            try:  
-                time_obj = datetime.strptime(time_str, "%Y-%m-%dT%H:%M:%S.%fZ")  
-                events.append((time_obj, row))  
-            except ValueError as e:  
-                print(f"Time format error for row: {row}, error: {e}")  
-                continue  
-
-    # Sort events chronologically  
-    events.sort(key=lambda x: x[0])  
-
-    last_kept_time = None  
-    for time_obj, row in events:  
-        if last_kept_time is None or (time_obj - last_kept_time) >= timedelta(minutes=20):  
-            time_str, lat, lon, depth, magnitude, mag_type = row  
-            new_time_str = time_obj.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]  
-            # This my custom catlog format following the our group tradition  
-            # Change and replace the placeholders if you want  
-            output_row = [  
-                "xxxxx",  # Placeholder for the first column  
-                new_time_str,  # Formatted time  
-                lat,  
-                lon,  
-                depth,  
-                "xxxx",  # Placeholder  
-                "yyyyy",  # Placeholder  
-                mag_type,  
-                magnitude,  
-                " ",  # Placeholder  
-            ]  
-            data.append((time_obj, output_row))  
-            last_kept_time = time_obj  
-
-    # Sort the kept data in reverse chronological order  
-    data.sort(key=lambda x: x[0], reverse=True)  
-
-    with open(output_file, "w", newline="", encoding="utf-8") as outfile:  
-        csvwriter = csv.writer(outfile)  
-        for _, output_row in data:  
-            csvwriter.writerow(output_row)  # Write formatted rows to the output file  
-
 def parse_custom_format(input_file, output_file):  
     # Parse the custom formatted input file and save it to a new output file  
     # This my custom catlog format following the our group tradition  
@@ -196,11 +235,20 @@ def parse_custom_format(input_file, output_file):
                 )  
             )  
 
+def read_args():  
+    parser = argparse.ArgumentParser()  
+    # "KOERI", "USGS", "ISC", "IRIS", "EMSC" or a base URL such as a local  
+    # FDSN stand-in, e.g. http://localhost:8080  
+    parser.add_argument("--provider", default="KOERI", help="FDSN provider or base URL")  
+    parser.add_argument("--workers", default=4, type=int, help="concurrent window requests")  
+    parser.add_argument("--cache_dir", default="events/cache", help="per-window QuakeML cache")  
+    parser.add_argument("--refresh", action="store_true", help="ignore the cache and refetch")  
+    parser.add_argument("--min_gap", default=20, type=float, help="minimum inter-event gap (minutes)")  
+    return parser.parse_args()  
+
 def main():  
     # Main function to execute the workflow  
-    client = Client("KOERI")  
-    # Connect to the IRIS FDSN service  
-    # "USGS" or "ISC" or "IRIS" or "EMSC"  
+    args = read_args()  
     # Define geographic boundaries  
     MINLAT = 37.00  
     MAXLAT = 39.00  
@@ -211,18 +259,15 @@ def main():
     start_date = datetime(2013, 5, 20)  
     end_date = datetime(2015, 5, 10)  
 
-    current_date = start_date  
-    all_events = []  
-
-    while current_date < end_date:  
-        next_month = current_date + relativedelta(months=1)  
-        STIME = current_date.strftime("%Y-%m-%d %H:%M:%S")  
-        ETIME = next_month.strftime("%Y-%m-%d %H:%M:%S")  
-
-        events = fetch_events(client, MINLAT, MAXLAT, MINLON, MAXLON, STIME, ETIME)  
-        all_events.append(events)  
-
-        current_date = next_month  
+    all_events = fetch_all_windows(  
+        args.provider,  
+        (MINLAT, MAXLAT, MINLON, MAXLON),  
+        (MINMAG, MAXMAG, MAXDEPTH),  
+        monthly_windows(start_date, end_date),  
+        args.cache_dir,  
+        workers=args.workers,  
+        refresh=args.refresh,  
+    )  
 
     # Output paths  
     output_csv = "events/CAP_20130501_20150503_IRIS.csv"  
@@ -230,8 +275,11 @@ def main():
     output_par = "events/CAP_IRIS_catlog.par"  
 
     save_events_to_csv(all_events, output_csv)  
-    convert_csv_to_custom_format(output_csv, output_txt)  
+    # Keep events at least --min_gap minutes apart  
+    convert_csv_to_custom_format(output_csv, output_txt, min_gap=timedelta(minutes=args.min_gap))  
     parse_custom_format(output_txt, output_par)  
+    # Typed binary twin of the .par read by the later steps  
+    write_catlog_npy(output_par)  
 
 if __name__ == "__main__":  
     main()  # Execute main function when the script is run
\ No newline at end of file
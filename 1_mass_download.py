@@ -7,7 +7,21 @@
 # INGV, IPGP, ISC, KNMI, KOERI, LMU, NCEDC, NIEP, NOA, RESIF, RESIFPH5, SCEDC,
 # TEXNET, UIB-NORSAR, USGS, USP, ORFEUS, IRIS
 ###############################################################################
+import argparse
+import glob
+import json
+import logging
+import numpy as np
 import obspy, os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from catlog_utils import load_catlog
+from station_store import StationStore
+from sds_archive import SDS_ROOT, cut_events, event_days, event_windows, sds_storage
+from obspy.clients.fdsn import Client
+from obspy.clients.fdsn.header import URL_MAPPINGS
 from obspy.clients.fdsn.mass_downloader import (
     RectangularDomain,
     Restrictions,
@@ -23,58 +37,79 @@ MAXLON = 36.50
 pre_event_min = 0.5
 aft_event_min = 2.5
 
-if os.path.exists("data"):
-    pass
-else:
-    os.mkdir("data")
+# No specified providers will result in all known ones being queried.
+PROVIDERS = [
+    # "KOERI",
+    "IRIS",
+]
+# Maximum number of events downloading from one provider at the same time;
+# each provider is queried by its own MassDownloader behind its own limit
+PROVIDER_CONCURRENCY = {
+    "KOERI": 2,
+    "IRIS": 4,
+}
+DEFAULT_PROVIDER_CONCURRENCY = 2
 
-if os.path.exists("response"):
-    pass
-else:
-    os.mkdir("response")
+MANIFEST = "data/download_manifest.jsonl"
 
-###############################################################################
-elf = open("catlog/KOERI_catlog.par", "r")
-el = elf.read().splitlines()
-elf.close()
-
-i = 0
-while i < len(el):
-    event = el[i].split()
-
-    event_dir = event[0]
-    ymd = event[1]
-    hour = event[2]
-    mini = event[3]
-    msec = event[4]
-
-    lat = event[5]
-    lon = event[6]
-    depth = event[7]
-
-    origin_time = obspy.UTCDateTime(ymd + " " + hour + ":" + mini + ":" + msec)
-
-    # event_dir = ymd + '.' + hour.zfill(2) + '.' + mini.zfill(2)
-
-    print("\033[1;34m Start downloading data for a new event \033[0m")
-    print("event number: " + str(i) + "; " + event_dir)
-
-    # Circular domain around the epicenter. This will download all data between
-    # 70 and 90 degrees distance from the epicenter. This module also offers
-    # rectangular and global domains. More complex domains can be defined by
-    # inheriting from the Domain class.
-    # domain = CircularDomain(latitude=37.52, longitude=143.04,
-    #                         minradius=70.0, maxradius=90.0)
-
-    # Rectangular domain
-    domain = RectangularDomain(
-        minlatitude=MINLAT,
-        maxlatitude=MAXLAT,
-        minlongitude=MINLON,
-        maxlongitude=MAXLON,
+
+def read_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default=4, type=int, help="events downloaded at the same time")
+    parser.add_argument("--retries", default=3, type=int, help="retries per event after a failure")
+    parser.add_argument("--backoff", default=10.0, type=float, help="first retry delay (s), doubled each retry")
+    parser.add_argument("--manifest", default=MANIFEST, help="per-event completion manifest")
+    # event: one request per event window; sds: day-long continuous data per
+    # station into a local SDS archive, event windows cut locally
+    parser.add_argument("--mode", default="event", choices=["event", "sds"], help="download mode")
+    return parser.parse_args()
+
+
+def load_manifest(manifest):
+    # Events whose last manifest entry is "done"
+    done = {}
+    if os.path.exists(manifest):
+        with open(manifest, "r") as mf:
+            for line in mf:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # truncated last line of an interrupted run
+                done[entry["event"]] = entry["status"] == "done"
+    return {event for event, is_done in done.items() if is_done}
+
+
+def append_manifest(manifest, entry):
+    with open(manifest, "a") as mf:
+        mf.write(json.dumps(entry) + "\n")
+        mf.flush()
+        os.fsync(mf.fileno())
+
+
+def sds_day_key(day):
+    # Manifest key of one archived day, e.g. sds:2014.060
+    return "sds:" + obspy.UTCDateTime(day).strftime("%Y.%j")
+
+
+def make_day_restrictions(day):
+    # Day-long continuous data; gaps and short channels are checked per event
+    # window when cutting, not for the whole day
+    day = obspy.UTCDateTime(day)
+    return Restrictions(
+        starttime=day,
+        endtime=day + 86400,
+        chunklength_in_sec=86400,
+        reject_channels_with_gaps=False,
+        minimum_length=0.0,
+        network="YB",
+        minimum_interstation_distance_in_m=10e2,
+        channel_priorities=["HH[ENZ]","BH[ENZ]"],
+        location_priorities=["", "00", "10"],
     )
 
-    restrictions = Restrictions(
+
+def make_restrictions(origin_time):
+    return Restrictions(
         # Get data from 5 minutes before the event to one hour after the
         # event. This defines the temporal bounds of the waveform data.
         starttime=origin_time - pre_event_min * 60,
@@ -101,22 +136,209 @@ while i < len(el):
         location_priorities=["", "00", "10"],
     )
 
-    # No specified providers will result in all known ones being queried.
 
-    mdl = MassDownloader(
-        providers=[
-            # "KOERI",
-            "IRIS",
-        ]
-    )
+def init_clients(providers):
+    # FDSN clients of the providers, in priority order (service discovery
+    # once per run); providers that cannot be reached or lack the
+    # dataselect/station services are skipped
+    if not providers:
+        providers = sorted(set(URL_MAPPINGS) - {"RASPISHAKE", "IRISPH5"})
+    clients = {}
+    for name in providers:
+        try:
+            client = Client(name)
+        except Exception as e:
+            print(f"\033[1;33m Provider {name} skipped: {type(e).__name__}: {e} \033[0m")
+            continue
+        if "dataselect" not in client.services or "station" not in client.services:
+            print(f"\033[1;33m Provider {name} skipped: no dataselect/station service \033[0m")
+            continue
+        clients[name] = client
+    return clients
+
+
+def configure_mass_downloader_logging():
+    # Console logging of the mass downloader, set up once (as
+    # MassDownloader(configure_logging=True) would on every instance)
+    logger = logging.getLogger("obspy.clients.fdsn.mass_downloader")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = 0
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setLevel(logging.INFO)
+        handler.setFormatter(logging.Formatter("[%(asctime)s] - %(name)s - %(levelname)s: %(message)s"))
+        logger.addHandler(handler)
+
+
+class DownloadScheduler:
+    # Downloads events concurrently. The FDSN clients are initialized once and
+    # shared by all workers. Every job queries the providers one after the
+    # other, in priority order, each through a single-provider MassDownloader
+    # (one per worker thread and provider) while holding only that provider's
+    # semaphore: a slow data center holds up its own requests, not the
+    # others'. Files already fetched from an earlier provider are skipped by
+    # the later ones, as within one multi-provider MassDownloader.
+    def __init__(self, providers, workers=4, retries=3, backoff=10.0):
+        configure_mass_downloader_logging()
+        self.clients = init_clients(providers)
+        if not self.clients:
+            raise RuntimeError(f"No usable FDSN provider among {providers}")
+        self.semaphores = {
+            name: threading.BoundedSemaphore(PROVIDER_CONCURRENCY.get(name, DEFAULT_PROVIDER_CONCURRENCY))
+            for name in self.clients
+        }
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self._local = threading.local()
+        # One StationXML per station and epoch, shared by all events
+        self.store = StationStore()
+
+        # Circular domain around the epicenter. This will download all data between
+        # 70 and 90 degrees distance from the epicenter. This module also offers
+        # rectangular and global domains. More complex domains can be defined by
+        # inheriting from the Domain class.
+        # domain = CircularDomain(latitude=37.52, longitude=143.04,
+        #                         minradius=70.0, maxradius=90.0)
 
-    # The data will be downloaded to the ``./waveforms/`` and ``./stations/``
-    # folders with automatically chosen file names.
-    mdl.download(
-        domain,
-        restrictions,
-        mseed_storage="data/" + event_dir,
-        stationxml_storage="response/" + event_dir,
+        # Rectangular domain
+        self.domain = RectangularDomain(
+            minlatitude=MINLAT,
+            maxlatitude=MAXLAT,
+            minlongitude=MINLON,
+            maxlongitude=MAXLON,
+        )
+
+    def _downloader(self, name):
+        # MassDownloader of one provider, one per worker thread
+        if not hasattr(self._local, "mdl"):
+            self._local.mdl = {}
+        if name not in self._local.mdl:
+            self._local.mdl[name] = MassDownloader(providers=[self.clients[name]], configure_logging=False)
+        return self._local.mdl[name]
+
+    def _download(self, key, restrictions, mseed_storage):
+        # One run over all providers with retries; returns the manifest entry
+        for attempt in range(self.retries + 1):
+            try:
+                for name in self.clients:
+                    with self.semaphores[name]:
+                        # Station metadata goes to the shared store in
+                        # ``./response/stations/`` only if it is not there yet.
+                        self._downloader(name).download(
+                            self.domain,
+                            restrictions,
+                            mseed_storage=mseed_storage,
+                            stationxml_storage=self.store.stationxml_storage,
+                            print_report=False,
+                        )
+                return {"event": key, "status": "done", "attempts": attempt + 1}
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+
+            if attempt < self.retries:
+                # Exponential backoff with jitter so retries do not arrive together
+                delay = self.backoff * 2**attempt * random.uniform(0.5, 1.5)
+                print(f"\033[1;33m {key} failed ({error}), retry in {delay:.0f} s \033[0m")
+                time.sleep(delay)
+
+        return {"event": key, "status": "failed", "attempts": self.retries + 1, "error": error}
+
+    def download_event(self, event):
+        event_dir = str(event["name"])
+        origin_time = obspy.UTCDateTime(float(event["epoch"]))
+
+        # The data will be downloaded to the ``./data/`` folder with
+        # automatically chosen file names.
+        entry = self._download(event_dir, make_restrictions(origin_time), "data/" + event_dir)
+        if entry["status"] == "done":
+            entry["n_mseed"] = len(glob.glob(f"data/{event_dir}/*.mseed"))
+        return entry
+
+    def download_day(self, day):
+        # One day of continuous data for all stations into the SDS archive
+        return self._download(sds_day_key(day), make_day_restrictions(day), sds_storage(SDS_ROOT))
+
+    def _run_jobs(self, jobs, download, manifest):
+        # Run download(job) for all jobs, appending each result to the manifest
+        n_failed = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(download, job) for job in jobs]
+            for i, future in enumerate(as_completed(futures), 1):
+                entry = future.result()
+                entry["time"] = obspy.UTCDateTime().isoformat()
+                append_manifest(manifest, entry)
+                if entry["status"] == "done":
+                    n_files = f": {entry['n_mseed']} mseed files" if "n_mseed" in entry else ""
+                    print(f"\033[1;34m [{i}/{len(jobs)}] {entry['event']}{n_files} \033[0m")
+                else:
+                    n_failed += 1
+                    print(f"\033[1;31m [{i}/{len(jobs)}] {entry['event']} failed: {entry['error']} \033[0m")
+        return n_failed
+
+    def run(self, catlog, manifest):
+        done = load_manifest(manifest)
+        pending = [event for event in catlog if str(event["name"]) not in done]
+        print(f"{len(catlog)} events in catalog, {len(catlog) - len(pending)} already downloaded, "
+              f"{len(pending)} to go with {self.workers} workers")
+
+        n_failed = self._run_jobs(pending, self.download_event, manifest)
+        print(f"Finished: {len(pending) - n_failed} events downloaded, {n_failed} failed "
+              f"(rerun to retry them)")
+
+    def run_sds(self, catlog, manifest):
+        # Continuous mode: fetch every day touched by an event window once,
+        # then cut all event windows from the local archive
+        done = load_manifest(manifest)
+        days = event_days(catlog, pre_event_min, aft_event_min)
+        pending_days = [day for day in days if sds_day_key(day) not in done]
+        print(f"{len(days)} days of continuous data needed, {len(days) - len(pending_days)} already archived, "
+              f"{len(pending_days)} to go with {self.workers} workers")
+        n_failed = self._run_jobs(pending_days, self.download_day, manifest)
+
+        # Cut the events whose days are all archived and which are not cut yet
+        done = load_manifest(manifest)
+        start, end = event_windows(catlog, pre_event_min, aft_event_min)
+        days_done = np.array([
+            sds_day_key(day_start) in done and sds_day_key(day_end) in done
+            for day_start, day_end in zip(start // 86400 * 86400, end // 86400 * 86400)
+        ], dtype=bool)
+        not_cut = np.array([str(name) not in done for name in catlog["name"]], dtype=bool)
+        to_cut = catlog[days_done & not_cut]
+        print(f"Cutting {len(to_cut)} event windows from the archive")
+        for event_dir, n_mseed in cut_events(to_cut, pre_event_min, aft_event_min, root=SDS_ROOT).items():
+            append_manifest(manifest, {
+                "event": event_dir, "status": "done", "mode": "sds", "n_mseed": n_mseed,
+                "time": obspy.UTCDateTime().isoformat(),
+            })
+
+        print(f"Finished: {len(pending_days) - n_failed} days downloaded, {n_failed} failed, "
+              f"{len(to_cut)} events cut (rerun to retry failed days)")
+
+
+def main():
+    args = read_args()
+
+    if os.path.exists("data"):
+        pass
+    else:
+        os.mkdir("data")
+
+    if os.path.exists("response"):
+        pass
+    else:
+        os.mkdir("response")
+
+    catlog = load_catlog("catlog/KOERI_catlog.par")
+
+    scheduler = DownloadScheduler(
+        PROVIDERS, workers=args.workers, retries=args.retries, backoff=args.backoff
     )
+    if args.mode == "sds":
+        scheduler.run_sds(catlog, args.manifest)
+    else:
+        scheduler.run(catlog, args.manifest)
+
 
-    i = i + 1
+if __name__ == "__main__":
+    main()
@@ -4,167 +4,511 @@
 # This script is for pre-processing seismic event waveform data
 # CAP from 2013 to 2015
 ###############################################################################
+import argparse
+import hashlib
+import io
+import json
 import os
-import subprocess
+import glob
+import shutil
+import time
 import logging
 from obspy import read, read_inventory, UTCDateTime
+from obspy.io.sac import SACTrace
 import multiprocessing as mp
+from catlog_utils import load_catlog
+from station_store import StationStore
+from raw_qc import QC_THRESHOLDS, qc_reasons
+from response_removal import PRE_FILT, WATER_LEVEL, ResponseCache, remove_response_batch
 
 ###############################################################################
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Station metadata store; each worker process keeps its own in-memory index
+# and parsed inventories for all events it processes
+STATION_STORE = StationStore()
+
+# Evaluated responses (pre_filt taper and water level applied) per channel
+# epoch, npts and sampling interval, reused for all events of a channel
+RESPONSE_CACHE = ResponseCache()
+
+# Maximum number of files of one channel deconvolved together
+BATCH_SIZE = 32
+
+# Processing parameters; changing any of them (or the version, after a change
+# of the processing code) reprocesses every file on the next run
+PROCESSING = {
+    "version": 1,
+    "output": "VEL",
+    "pre_filt": list(PRE_FILT),
+    "water_level": WATER_LEVEL,
+    "taper": 0.05,
+    "local_dist_km": [10, 100],
+    "qc": QC_THRESHOLDS,
+}
+
+# One JSON line per processed MiniSEED file, the last line of a file wins
+MANIFEST = "vel_data/remove_resp_manifest.jsonl"
+
+# Channel epochs whose response failed, "NET.STA.LOC.CHA|epoch start" ->
+# {"error", "event", "response"}. Persisted between runs, and shared with the
+# worker processes during a run so a bad response fails only once
+BAD_RESPONSES_FILE = "response/bad_responses.json"
+BAD_RESPONSES = {}
+
+def read_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--manifest", default=MANIFEST, help="processing manifest")
+    parser.add_argument("--force", action="store_true", help="reprocess all files, ignoring the manifest")
+    return parser.parse_args()
+
+def init_worker(bad_responses):
+    # Pool initializer: use the registry shared by the main process
+    global BAD_RESPONSES
+    BAD_RESPONSES = bad_responses
+
 def create_directories(*dirs):
     # Create directories if they don't exist
     for dir in dirs:
         os.makedirs(dir, exist_ok=True)
 
-def process_mseed(event_dir, mseed, origin_time, evla, evlo, evdp, hour, mini, msec, error_resp_station):
-    # Process a single MiniSEED file
-    # Read the MiniSEED file, remove instrument response, and write processed data to SAC files
-    
-    # Read the MiniSEED file
-    st = read(f"data/{event_dir}/{mseed}")
+def load_mseed(event_dir, raw):
+    # Read one MiniSEED file from its bytes, check the raw counts, look its
+    # response up and pre-process it. Returns (trace, inventory, station_id,
+    # qc_reasons); (None, None, bad_qc, qc_reasons) if the raw data fail the QC
+    # and (None, None, no_resp, []) if no response file is found
+    st = read(io.BytesIO(raw))
     head = st[0]
     
     station_id = f"{head.stats.network}.{head.stats.station}"
     logger.info(f"Event: {event_dir} ; Station: {station_id}")
+
+    # Dead, clipped, spiky or saturated channels are dropped before any
+    # processing
+    reasons = qc_reasons(head.data, PROCESSING["qc"])[0]
+    if reasons:
+        logger.warning(f"{station_id}.{head.stats.channel} failed the raw data QC ({'; '.join(reasons)}), skipping")
+        return None, None, f"{event_dir}: {station_id}.{head.stats.channel}", reasons
     
-    # Attempt to read the response file
-    resp = f"response/{event_dir}/{station_id}.xml"
-    try:
-        inv = read_inventory(resp)
-    except FileNotFoundError:
-        logger.error(f"Can't find the response file for {station_id}, skipping")
-        return f"{event_dir}: {station_id}.{head.stats.channel}", None
-    
-    if station_id in error_resp_station:
-        logger.warning(f"{station_id} response file is wrong, skip")
-        return None, None
+    # Look the response up in the station store, falling back to the
+    # per-event response file of older downloads
+    inv = STATION_STORE.select(
+        head.stats.network, head.stats.station, head.stats.location, head.stats.channel, head.stats.starttime
+    )
+    if inv is None:
+        resp = f"response/{event_dir}/{station_id}.xml"
+        try:
+            inv = read_inventory(resp)
+        except FileNotFoundError:
+            logger.error(f"Can't find the response file for {station_id}, skipping")
+            return None, None, f"{event_dir}: {station_id}.{head.stats.channel}", []
     
+    if len(st) > 1:
+        logger.warning(f"{station_id}.{head.stats.channel} has {len(st)} segments, keeping the first")
+    tr = st[0]
+
+    # Pre-process the waveform
+    tr.detrend(type="demean")
+    tr.detrend(type="linear")
+    tr.taper(max_percentage=PROCESSING["taper"])
+    return tr, inv, station_id, []
+
+def write_sac(event_dir, tr, inv, station_id, origin_time, evla, evlo, evdp, hour, mini, msec):
+    # Write the SAC file(s) of one trace, returns the written paths
     # Extract station coordinates
     stla, stlo, stel = inv.networks[0].stations[0].latitude, inv.networks[0].stations[0].longitude, inv.networks[0].stations[0].elevation
-    
-    # Pre-process the waveform
-    st.detrend(type="demean")
-    st.detrend(type="linear")
-    st.taper(max_percentage=0.05)
-    
-    # Remove instrument response
-    try:
-        st.remove_response(inventory=inv, output="VEL", pre_filt=[0.5, 1.0, 20, 25])
-    except Exception:
-        logger.error(f"The response file for {station_id} is wrong, skipping")
-        return None, f"{event_dir}: {station_id}.{head.stats.channel}"
-    
-    logger.info(f"Finished removing response for {station_id}")
-    
-    # Create SAC filename and write to file
-    newsacname = f"{origin_time.year}.{origin_time.julday:03d}.{hour}.{mini}.{msec}.{station_id}..{head.stats.channel}.SAC"
+
+    # Create SAC filename, set the SAC headers in memory and write once.
+    # An earlier file is removed first rather than overwritten, so links to
+    # it from the local subsets keep their own content
+    newsacname = f"{origin_time.year}.{origin_time.julday:03d}.{hour}.{mini}.{msec}.{station_id}..{tr.stats.channel}.SAC"
     output_path = f"vel_data/{event_dir}/{newsacname}"
-    st.write(output_path, format="SAC")
-    
-    # Update SAC headers
-    update_sac_headers(output_path, evlo, evla, evdp, stlo, stla, stel, origin_time, hour, mini, msec)
-    
-    # Write local data if within 110 km
-    local_st = read(output_path)
-    if 10 <= local_st[0].stats.sac.dist <= 100:
-        local_st.write(f"local_vel_data/{event_dir}/{newsacname}", format="SAC")
+    sac = set_sac_headers(tr, evlo, evla, evdp, stlo, stla, stel, origin_time)
+    if os.path.lexists(output_path):
+        os.remove(output_path)
+    sac.write(output_path)
+    outputs = [output_path]
+
+    # Local data within the distance range, using the distance computed in
+    # memory: hard links to the single written file
+    min_dist, max_dist = PROCESSING["local_dist_km"]
+    if min_dist <= sac.dist <= max_dist:
+        outputs.append(f"local_vel_data/{event_dir}/{newsacname}")
+        link_or_copy(output_path, outputs[-1])
         if newsacname.endswith(".BHZ.SAC"):
-            local_st.write(f"local_vel_data_BHZ/{event_dir}/{newsacname}", format="SAC")
-    
-    return None, None
-
-def update_sac_headers(sac_file, evlo, evla, evdp, stlo, stla, stel, origin_time, hour, mini, msec):
-    # Update SAC headers using SAC commands
-    s = f"""
-    wild echo off
-    r {sac_file}
-    ch LCALDA True
-    ch evlo {evlo} evla {evla} evdp {evdp}
-    ch stlo {stlo} stla {stla} stel {stel}
-    ch t1 0.0 t2 0.0 t3 0.0 t4 0.0
-    ch o gmt {origin_time.year} {origin_time.julday} {hour} {mini} {msec.split('.')[0]} {msec.split('.')[1]}
-    wh
-    q
-    """
-    subprocess.run(["sac"], input=s.encode(), check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-def process_event(event_line, ievent):
-    event = event_line.split()
-
-    event_dir = event[0]
-    ymd = event[1]
-    hour = event[2]
-    mini = event[3]
-    msec = event[4]
-    evla = event[5]
-    evlo = event[6]
-    evdp = event[7]
-
-    origin_time = UTCDateTime(f"{ymd} {hour}:{mini}:{msec}")
-    
-    logger.info(f"Pre-processing event: {event_dir}, number is {ievent}")
-    logger.info(f"Origin time: {origin_time}")
-    
-    # Create event-specific directories
+            outputs.append(f"local_vel_data_BHZ/{event_dir}/{newsacname}")
+            link_or_copy(output_path, outputs[-1])
+    return outputs
+
+def link_or_copy(src, dst):
+    # Hard link dst to src, or copy it on file systems without hard links
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def set_sac_headers(tr, evlo, evla, evdp, stlo, stla, stel, origin_time):
+    # Build the SAC header in memory (formerly done by running `sac` on each
+    # written file). With lcalda set, dist/az/baz/gcarc are computed from the
+    # event and station coordinates as soon as they are assigned
+    sac = SACTrace.from_obspy_trace(tr)
+    sac.lcalda = True
+    sac.evlo, sac.evla, sac.evdp = evlo, evla, evdp
+    sac.stlo, sac.stla, sac.stel = stlo, stla, stel
+    sac.t1, sac.t2, sac.t3, sac.t4 = 0.0, 0.0, 0.0, 0.0
+    # Origin time, stored relative to the reference time like `ch o gmt`
+    sac.o = origin_time
+    return sac
+
+def event_parameters(event):
+    # event is one record of the binary catalog (see catlog_utils.CATLOG_DTYPE)
+    event_dir = str(event["name"])
+    hour = str(event["hour"])
+    mini = str(event["mini"])
+    msec = str(event["msec"])
+    evla = float(event["lat"])
+    evlo = float(event["lon"])
+    evdp = float(event["depth"])
+
+    origin_time = UTCDateTime(float(event["epoch"]))
+    return event_dir, origin_time, evla, evlo, evdp, hour, mini, msec
+
+def prepare_event(event):
+    # Create the event output directories and list its MiniSEED files
+    event_dir = str(event["name"])
     create_directories(f"vel_data/{event_dir}", f"local_vel_data/{event_dir}", f"local_vel_data_BHZ/{event_dir}")
-    
-    # List MiniSEED files for the event
-    os.system(f"ls data/{event_dir}/*.mseed > data/{event_dir}/mseedfiles.txt")
-    
-    with open(f"data/{event_dir}/mseedfiles.txt", "r") as mseedlf:
-        mseedl = mseedlf.read().splitlines()
-    
-    error_resp_station = set()
-    no_resp_station = []
-    
-    # Process each MiniSEED file
-    for mseed in mseedl:
-        no_resp, error_resp = process_mseed(event_dir, os.path.basename(mseed), origin_time, evla, evlo, evdp, hour, mini, msec, error_resp_station)
-        if no_resp:
-            no_resp_station.append(no_resp)
-        if error_resp:
-            error_resp_station.add(error_resp)
-    
-    return no_resp_station, list(error_resp_station)
+    return sorted(os.path.basename(f) for f in glob.glob(f"data/{event_dir}/*.mseed"))
+
+def parse_mseed_name(mseed):
+    # (network, station, location, channel, starttime) of a mass downloader
+    # file name NET.STA.LOC.CHA__START__END.mseed, or None
+    try:
+        seed_id, start = mseed.split("__")[:2]
+        network, station, location, channel = seed_id.split(".")
+        return network, station, location, channel, UTCDateTime(start)
+    except Exception:
+        return None
+
+def bad_response_key(network, station, location, channel, time):
+    # Registry key of the store channel epoch active at `time`, or None if the
+    # response does not come from the station store
+    epoch = STATION_STORE.epoch_start(network, station, location, channel, time)
+    return None if epoch is None else f"{network}.{station}.{location}.{channel}|{epoch}"
+
+def load_bad_responses(path=BAD_RESPONSES_FILE):
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return {}
+
+def save_bad_responses(registry, path=BAD_RESPONSES_FILE):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(registry, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def process_batch(batch):
+    # One task of the work queue: MiniSEED files of one channel from several
+    # events. Traces sharing a response epoch and length are deconvolved in
+    # one batched FFT, with the evaluated response cached per process.
+    # Returns one manifest entry per file; the batched deconvolution time is
+    # shared evenly among its files
+    results = {}
+    loaded = []
+    for event, mseed in batch:
+        event_dir = str(event["name"])
+        start = time.perf_counter()
+        result = results[(event_dir, mseed)] = {
+            "input": f"{event_dir}/{mseed}", "status": "failed", "station": None, "outputs": [],
+        }
+        try:
+            path = f"data/{event_dir}/{mseed}"
+            stat = os.stat(path)
+            # Channel epoch already known to have a bad response: no work
+            parsed = parse_mseed_name(mseed)
+            key = bad_response_key(*parsed) if parsed else None
+            if key is not None and key in BAD_RESPONSES:
+                network, station, _, channel, _ = parsed
+                result.update(status="error_resp", station=f"{event_dir}: {network}.{station}.{channel}",
+                              bad_response=key, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                result["seconds"] = time.perf_counter() - start
+                continue
+            with open(path, "rb") as f:
+                raw = f.read()
+            result.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha1=hashlib.sha1(raw).hexdigest())
+            tr, inv, station_id, reasons = load_mseed(event_dir, raw)
+            if reasons:
+                result.update(status="bad_qc", station=station_id, qc=reasons)
+            elif tr is None:
+                result.update(status="no_resp", station=station_id)
+            else:
+                loaded.append((event, mseed, tr, inv, station_id))
+        except Exception as e:
+            logger.error(f"Failed to process {event_dir}/{mseed}: {e}")
+        result["seconds"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    errors = remove_response_batch(
+        [tr for _, _, tr, _, _ in loaded], [inv for _, _, _, inv, _ in loaded], RESPONSE_CACHE,
+        output=PROCESSING["output"], pre_filt=PROCESSING["pre_filt"], water_level=PROCESSING["water_level"],
+    )
+    share = (time.perf_counter() - start) / max(1, len(loaded))
+
+    for (event, mseed, tr, inv, station_id), error in zip(loaded, errors):
+        event_dir, origin_time, evla, evlo, evdp, hour, mini, msec = event_parameters(event)
+        result = results[(event_dir, mseed)]
+        start = time.perf_counter()
+        if error is not None:
+            logger.error(f"The response file for {station_id} is wrong, skipping")
+            result.update(status="error_resp", station=f"{event_dir}: {station_id}.{tr.stats.channel}")
+            key = bad_response_key(
+                tr.stats.network, tr.stats.station, tr.stats.location, tr.stats.channel, tr.stats.starttime
+            )
+            if key is not None:
+                BAD_RESPONSES[key] = {"error": f"{type(error).__name__}: {error}", "event": event_dir}
+                result["bad_response"] = key
+        else:
+            logger.info(f"Finished removing response for {station_id}")
+            try:
+                result["outputs"] = write_sac(
+                    event_dir, tr, inv, station_id, origin_time, evla, evlo, evdp, hour, mini, msec
+                )
+                result["status"] = "done"
+            except Exception as e:
+                logger.error(f"Failed to process {event_dir}/{mseed}: {e}")
+        result["seconds"] += share + time.perf_counter() - start
+
+    return list(results.values())
+
+def make_batches(tasks, batch_size=BATCH_SIZE):
+    # Group the (event, mseed) tasks by channel (file name up to the first
+    # "__", e.g. YB.ACTO..BHZ) and split each group into batches of at most
+    # batch_size files, so batches stay small enough to balance the workers
+    groups = {}
+    for event, mseed in tasks:
+        groups.setdefault(mseed.split("__")[0], []).append((event, mseed))
+    return [
+        files[i:i + batch_size]
+        for _, files in sorted(groups.items())
+        for i in range(0, len(files), batch_size)
+    ]
+
+def task_chunksize(n_tasks, n_workers):
+    # Small chunks keep the workers balanced at the end of the run, large
+    # enough chunks keep the queue overhead low on big archives
+    return max(1, min(32, n_tasks // (n_workers * 16)))
+
+def load_manifest(manifest):
+    # Last manifest entry of every input file
+    entries = {}
+    if os.path.exists(manifest):
+        with open(manifest, "r") as mf:
+            for line in mf:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # truncated last line of an interrupted run
+                entries[entry["input"]] = entry
+    return entries
+
+def append_manifest(manifest, entries):
+    with open(manifest, "a") as mf:
+        mf.writelines(json.dumps(entry) + "\n" for entry in entries)
+        mf.flush()
+        os.fsync(mf.fileno())
+
+def params_hash():
+    return hashlib.sha1(json.dumps(PROCESSING, sort_keys=True).encode()).hexdigest()
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def response_hash(event_dir, mseed, file_hashes):
+    # Hash of all station metadata a file may take its response from: the
+    # station's files in the store and the per-event fallback file. Editing,
+    # adding or removing any of them makes the station's files stale.
+    # file_hashes caches the content hash of each metadata file for the run
+    network, station = (mseed.split(".") + [""])[:2]
+    paths = [path for path in STATION_STORE.station_files(network, station) if os.path.exists(path)]
+    fallback = f"response/{event_dir}/{network}.{station}.xml"
+    if os.path.exists(fallback):
+        paths.append(fallback)
+    h = hashlib.sha1()
+    for path in paths:
+        if path not in file_hashes:
+            file_hashes[path] = file_sha1(path)
+        h.update(f"{os.path.basename(path)}:{file_hashes[path]}\n".encode())
+    return h.hexdigest()
+
+def epoch_response_hash(parsed, file_hashes):
+    # Content hash of the store StationXML holding the channel epoch a bad
+    # response is registered for; the per-event fallback files do not enter
+    # it, so events with different fallbacks share the registry entry
+    path = STATION_STORE.epoch_file(*parsed) if parsed else None
+    if path is None or not os.path.exists(path):
+        return None
+    if path not in file_hashes:
+        file_hashes[path] = file_sha1(path)
+    return file_hashes[path]
+
+def is_current(entry, path, params, response):
+    # True if the manifest entry is up to date for the input file. The input
+    # content is only hashed again when its size or mtime changed; then the
+    # entry is refreshed in place with the new stat. Failed files are retried
+    if entry is None or entry["status"] == "failed":
+        return False
+    if entry.get("params") != params or entry.get("response") != response:
+        return False
+    if not all(os.path.exists(output) for output in entry["outputs"]):
+        return False
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    if (stat.st_size, stat.st_mtime_ns) == (entry.get("size"), entry.get("mtime_ns")):
+        return True
+    if stat.st_size != entry.get("size") or file_sha1(path) != entry.get("sha1"):
+        return False
+    entry["mtime_ns"] = stat.st_mtime_ns
+    entry["refreshed"] = True
+    return True
+
+def remove_outputs(entry):
+    # Delete the outputs of a stale entry, so a file that is no longer within
+    # the local distance does not stay in the local subsets
+    for output in entry["outputs"] if entry else []:
+        if os.path.exists(output):
+            os.remove(output)
 
 def main():
     # Main function to process all seismic events
+    args = read_args()
     
     # Create necessary directories
     create_directories("vel_data", "local_vel_data", "local_vel_data_BHZ")
     
     # Read the event catalog
-    with open("catlog/KOERI_catlog.par", "r") as eplf:
-        epls = eplf.read().splitlines()
-    
-    # Set up multiprocessing pool
-    pool = mp.Pool(processes=mp.cpu_count())
-    
-    # Process events in parallel
-    results = pool.starmap(process_event, [(event_line, i) for i, event_line in enumerate(epls, 1)])
-    
-    # Close the pool and wait for the work to finish
-    pool.close()
-    pool.join()
+    catlog = load_catlog("catlog/KOERI_catlog.par")
+
+    # All MiniSEED files; those whose input, station metadata, processing
+    # parameters and outputs are unchanged since the last run are skipped
+    tasks = [(event, mseed) for event in catlog for mseed in prepare_event(event)]
+    manifest = {} if args.force else load_manifest(args.manifest)
+    params = params_hash()
+    file_hashes = {}
+    responses = {}
+    pending = []
+    skipped = []
+    for event, mseed in tasks:
+        event_dir = str(event["name"])
+        key = f"{event_dir}/{mseed}"
+        responses[key] = response_hash(event_dir, mseed, file_hashes)
+        entry = manifest.get(key)
+        if is_current(entry, f"data/{key}", params, responses[key]):
+            skipped.append(entry)
+        else:
+            remove_outputs(entry)
+            pending.append((event, mseed))
+    refreshed = [entry for entry in skipped if entry.pop("refreshed", False)]
+    if refreshed:
+        append_manifest(args.manifest, refreshed)
+
+    # Files of channel epochs registered with a bad response are skipped
+    # without any work; registry entries whose store StationXML changed since
+    # are dropped, so fixed responses are tried again
+    registry = load_bad_responses()
+    epoch_responses = {}
+    known_bad = []
+    to_process = []
+    for event, mseed in pending:
+        event_dir = str(event["name"])
+        key = f"{event_dir}/{mseed}"
+        parsed = parse_mseed_name(mseed)
+        bad_key = bad_response_key(*parsed) if parsed else None
+        epoch_responses[key] = epoch_response_hash(parsed, file_hashes)
+        if bad_key in registry and registry[bad_key]["response"] != epoch_responses[key]:
+            logger.info(f"Station metadata of {bad_key} changed, trying its response again")
+            del registry[bad_key]
+        if bad_key in registry:
+            network, station, _, channel, _ = parsed
+            stat = os.stat(f"data/{key}")
+            known_bad.append({
+                "input": key, "status": "error_resp", "station": f"{event_dir}: {network}.{station}.{channel}",
+                "outputs": [], "bad_response": bad_key, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                "params": params, "response": responses[key],
+            })
+        else:
+            to_process.append((event, mseed))
+    if known_bad:
+        append_manifest(args.manifest, known_bad)
+
+    # Work queue of per-channel file batches over all stale or new files
+    batches = make_batches(to_process)
+    n_workers = mp.cpu_count()
+    chunksize = task_chunksize(len(batches), n_workers)
+    logger.info(f"{len(tasks)} MiniSEED files of {len(catlog)} events, {len(skipped)} up to date, "
+                f"{len(known_bad)} with a known bad response, {len(to_process)} to process in "
+                f"{len(batches)} batches, {n_workers} workers, chunksize {chunksize}")
     
-    # Aggregate results
-    no_resp_station = []
-    error_resp_station = set()
-    for no_resp, error_resp in results:
-        no_resp_station.extend(no_resp)
-        error_resp_station.update(error_resp)
+    # Results are aggregated as they arrive; the log also lists the stations
+    # of files skipped as up to date or with a known bad response
+    no_resp_station = [entry["station"] for entry in skipped if entry["status"] == "no_resp"]
+    bad_qc_station = [f"{entry['station']}: {'; '.join(entry['qc'])}" for entry in skipped if entry["status"] == "bad_qc"]
+    error_resp_station = {entry["station"] for entry in skipped + known_bad if entry["status"] == "error_resp"}
+    timings = []
+    start = time.perf_counter()
+    with mp.Manager() as manager:
+        shared_registry = manager.dict(registry)
+        with mp.Pool(processes=n_workers, initializer=init_worker, initargs=(shared_registry,)) as pool:
+            for results in pool.imap_unordered(process_batch, batches, chunksize=chunksize):
+                for result in results:
+                    result.update(params=params, response=responses[result["input"]])
+                    if result["status"] == "no_resp":
+                        no_resp_station.append(result["station"])
+                    elif result["status"] == "bad_qc":
+                        bad_qc_station.append(f"{result['station']}: {'; '.join(result['qc'])}")
+                    elif result["status"] == "error_resp":
+                        error_resp_station.add(result["station"])
+                        bad_key = result.get("bad_response")
+                        if bad_key and bad_key not in registry:
+                            registry[bad_key] = dict(shared_registry[bad_key], response=epoch_responses[result["input"]])
+                            save_bad_responses(registry)
+                    timings.append((result.pop("seconds"), result["input"]))
+                    if len(timings) % 1000 == 0 or len(timings) == len(to_process):
+                        logger.info(f"Progress: {len(timings)}/{len(to_process)} files in {time.perf_counter() - start:.0f} s")
+                append_manifest(args.manifest, results)
+    save_bad_responses(registry)
+
+    # Per-task timing, slowest first, to spot stragglers
+    timings.sort(reverse=True)
+    with open("1_remove_resp_timing.txt", "w") as timing_log:
+        timing_log.write("seconds file\n")
+        timing_log.writelines(f"{elapsed:.3f} {name}\n" for elapsed, name in timings)
+    if timings:
+        total = sum(elapsed for elapsed, _ in timings)
+        logger.info(f"Task time: total {total:.0f} s, mean {total / len(timings):.2f} s, max {timings[0][0]:.2f} s")
+        for elapsed, name in timings[:5]:
+            logger.info(f"Slowest: {elapsed:.2f} s {name}")
 
     # Write log file with stations that had issues
     with open("1_remove_resp_log.txt", "w") as log:
         log.write("--------------------------------------------------------------------------\n")
         log.write(f"{len(no_resp_station)} stations have no response file, listed as follows:\n")
-        log.write("\n".join(no_resp_station) + "\n")
+        log.write("\n".join(sorted(no_resp_station)) + "\n")
         log.write(f"{len(error_resp_station)} stations have wrong response file, listed as follows:\n")
-        log.write("\n".join(error_resp_station) + "\n")
+        log.write("\n".join(sorted(error_resp_station)) + "\n")
+        log.write(f"{len(bad_qc_station)} stations failed the raw data QC, listed as follows:\n")
+        log.write("\n".join(sorted(bad_qc_station)) + "\n")
+        log.write(f"{len(registry)} channel epochs are registered with a bad response in {BAD_RESPONSES_FILE}:\n")
+        log.write("".join(f"{key} ({entry['event']}): {entry['error']}\n" for key, entry in sorted(registry.items())))
 
 if __name__ == "__main__":
     main()
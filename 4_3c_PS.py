@@ -4,13 +4,22 @@
 # It prepares SAC files for further AI-based picking methods like PhaseNet.
 # It specifically handles BHZ, BHN, and BHE components.
 ###############################################################################
+import argparse
+import contextlib
 import os
+import sys
 import glob
-import subprocess
 import shutil
 import csv
 import re
 import datetime
+import numpy as np
+from catlog_utils import load_catlog
+from sac_io import FNULL, patch_headers, read_sac_headers
+from travel_times import TravelTimeTable
+
+# PhaseNet modules import each other by their plain names
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "phasenet"))
 ###############################################################################
 def parse_sac_filename(filename):
     pattern = r'(\d{4}\.\d{3}\.\d{2}\.\d{2}\.\d{2}\.\d{3})\.([^.]+)\.([^.]+)\.\.(BH[ZNE])\.SAC'
@@ -20,19 +29,48 @@ def parse_sac_filename(filename):
         return timestamp, network, station, channel
     return None
 
-def process_events(base_dir, cap_sac_dir):
+def set_arrivals(sac_files, table):
+    # t1/t2 (kt1/kt2) = origin time + first P/S travel time of every file,
+    # interpolated from the travel-time tables in one call and written
+    # straight into the headers (formerly `taup setsac` per event directory)
+    headers, valid = read_sac_headers(sac_files)
+    valid &= (headers["o"] != FNULL) & (headers["gcarc"] != FNULL) & (headers["evdp"] != FNULL)
+    times = table.travel_times(
+        np.where(valid, headers["gcarc"], np.nan), np.where(valid, headers["evdp"], np.nan)
+    )
+    t1 = headers["o"] + times["P"]
+    t2 = headers["o"] + times["S"]
+    for sac_file in np.asarray(sac_files, dtype=object)[np.isnan(t1) | np.isnan(t2)]:
+        print(f"No P/S arrival for {sac_file} (missing header or outside the travel-time grid)")
+    # The kt1/kt2 labels only go with the picks that are written. The files
+    # are hard links of vel_data/ (2_remove_response.py) and are patched
+    # through the shared inode, so they are not copied again; vel_data/ and
+    # local_vel_data_BHZ/ get the same t1/t2 headers
+    files = np.asarray(sac_files, dtype=object)
+    has_t1, has_t2 = ~np.isnan(t1), ~np.isnan(t2)
+    patch_headers({
+        "file": np.concatenate([files[has_t1], files[has_t1], files[has_t2], files[has_t2]]),
+        "field": np.repeat(np.array(["t1", "kt1", "t2", "kt2"], dtype=object),
+                           [has_t1.sum(), has_t1.sum(), has_t2.sum(), has_t2.sum()]),
+        "value": np.concatenate([
+            t1[has_t1].astype(object), np.full(has_t1.sum(), "P", dtype=object),
+            t2[has_t2].astype(object), np.full(has_t2.sum(), "S", dtype=object),
+        ]),
+    }, detach_links=False)
+    return int(np.sum(has_t1 & has_t2))
+
+def process_events(base_dir, cap_sac_dir, model="prem"):
     script_dir = os.path.dirname(os.path.abspath(__file__))
     
-    with open(os.path.join(script_dir, "log", "KOERI_catlog_updated.par"), "r") as elf:
-        event_lines = elf.read().splitlines()
+    events = load_catlog(os.path.join(script_dir, "log", "KOERI_catlog_updated.par"))
 
     os.makedirs(cap_sac_dir, exist_ok=True)
 
     processed_stations = set()
 
-    for line in event_lines:
-        event = line.split()
-        event_dir = event[0]
+    event_files = []
+    for event in events:
+        event_dir = str(event["name"])
 
         event_path = os.path.join(base_dir, event_dir)
         if not os.path.isdir(event_path):
@@ -43,16 +81,24 @@ def process_events(base_dir, cap_sac_dir):
         if not sac_files:
             print(f"No SAC files found in {event_dir}, skipping.")
             continue
-
-        try:
-            subprocess.run(
-                ["taup", "setsac", "-mod", "prem", "-evdpkm", "-ph", "P-1,S-2"] + sac_files,
-                check=True
-            )
-            print(f"Processed SAC files in {event_dir}.")
-        except subprocess.CalledProcessError as e:
-            print(f"Error processing SAC files in {event_dir}: {e}")
-
+        event_files.append(sac_files)
+
+    # Theoretical arrivals of all events at once, on a grid covering the
+    # distances and depths of the data
+    all_files = [sac_file for sac_files in event_files for sac_file in sac_files]
+    if not all_files:
+        print("No SAC files to process.")
+        return set()
+    headers, _ = read_sac_headers(all_files)
+    table = TravelTimeTable(
+        model,
+        max_distance=np.where(headers["gcarc"] != FNULL, headers["gcarc"], 0.0),
+        max_depth=np.where(headers["evdp"] != FNULL, headers["evdp"], 0.0),
+    )
+    n_set = set_arrivals(all_files, table)
+    print(f"Set P/S arrivals ({model}) in {n_set} of {len(all_files)} SAC files of {len(event_files)} events.")
+
+    for sac_files in event_files:
         station_files = {}
         for sac_file in sac_files:
             parsed = parse_sac_filename(os.path.basename(sac_file))
@@ -121,27 +167,54 @@ def write_filenames_to_csv(folder_path, output_csv):
 
     print(f"Station filenames have been written to '{output_csv}'.")
 
-def run_phasenet(data_list, data_dir, result_dir):
-    command = [
-        "python", "phasenet/predict.py",
-        "--model=model/190703-214543",
-        f"--data_list={data_list}",
-        f"--data_dir={data_dir}",
-        "--format=sac",
-        "--batch_size=1",
-        "--plot_figure",
-        f"--result_dir={result_dir}"
-    ]
-    subprocess.run(command, check=True)
+def bundle_station_events(data_list, data_dir, hdf5_file):
+    # One HDF5 dataset per station-event: the E/N/Z files of each sac.csv
+    # group read, merged, trimmed and aligned once, so PhaseNet reads one
+    # array per sample (python phasenet/predict.py --format=hdf5 ...)
+    from data_reader import write_hdf5_bundle
+
+    with open(data_list, newline='', encoding='utf-8') as csvfile:
+        file_groups = [row['fname'] for row in csv.DictReader(csvfile)]
+    names = write_hdf5_bundle(file_groups, data_dir, hdf5_file)
+    print(f"Bundled {len(names)} of {len(file_groups)} station-events into '{hdf5_file}'.")
+
+def run_phasenet(hdf5_file, result_dir, batch_size=20, plot_figure=False):
+    # PhaseNet in this process (phasenet/predict.py API): the model is loaded
+    # once and the bundled 3-component samples are picked in batches;
+    # figures, if asked for, are drawn by a process pool in the background
+    from predict import FigureWriter, predict_picks
+
+    os.makedirs(result_dir, exist_ok=True)
+    figures = FigureWriter(os.path.join(result_dir, "figures")) if plot_figure else contextlib.nullcontext()
+    with figures:
+        picks = predict_picks(
+            model_dir="model/190703-214543",
+            hdf5_file=hdf5_file,
+            batch_size=batch_size,
+            figures=figures if plot_figure else None,
+        )
+        picks.to_csv(os.path.join(result_dir, "picks.csv"), index=False)
+        print(f"Done with {np.sum(picks['phase_type'] == 'P')} P-picks and {np.sum(picks['phase_type'] == 'S')} S-picks")
+    return picks
+
+def read_args():
+    parser = argparse.ArgumentParser()
+    # TauP model name or local 1D velocity model file (.nd or .tvel)
+    parser.add_argument("--model", default="prem", help="velocity model for the P/S arrivals")
+    parser.add_argument("--batch_size", default=20, type=int, help="PhaseNet batch size")
+    parser.add_argument("--plot_figure", action="store_true", help="draw a PhaseNet figure per station")
+    return parser.parse_args()
 
 def main():
+    args = read_args()
     base_directory = os.path.abspath("local_vel_data")  # Base path for event directories
     cap_sac_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CAP_4Pick_3SAC")
     output_csv = os.path.join(cap_sac_dir, "sac.csv")
+    hdf5_file = os.path.join(cap_sac_dir, "sac.h5")
     result_dir = os.path.join(cap_sac_dir, "results")
 
     # Step 1: Process events and copy SAC files
-    processed_stations = process_events(base_directory, cap_sac_dir)
+    processed_stations = process_events(base_directory, cap_sac_dir, model=args.model)
 
     # Step 2: Rename SAC files in place
     rename_sac_files(cap_sac_dir)
@@ -149,8 +222,11 @@ def main():
     # Step 3: Generate CSV file
     write_filenames_to_csv(cap_sac_dir, output_csv)
 
-    # Step 4: Run phasenet
-    run_phasenet(output_csv, cap_sac_dir, result_dir)
+    # Step 4: Pack each station-event into one HDF5 dataset
+    bundle_station_events(output_csv, cap_sac_dir, hdf5_file)
+
+    # Step 5: Run phasenet
+    run_phasenet(hdf5_file, result_dir, batch_size=args.batch_size, plot_figure=args.plot_figure)
 
     print(f"Processed {len(processed_stations)} stations")
     print(f"Created {output_csv} with the list of processed stations")
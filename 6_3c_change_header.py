@@ -1,7 +1,7 @@
 import pandas as pd  
-from obspy import read  
+import numpy as np  
 import os  
-import shutil  
+from sac_io import clone_file, patch_headers  
 
 # Read the filtered_picks.csv file  
 df = pd.read_csv('CAP_5Filter_3SAC/final_filtered_picks.csv')  
@@ -13,9 +13,9 @@ df['phase_time'] = pd.to_datetime(df['phase_time'])
 # Calculate time differences in seconds  
 df['time_diff'] = (df['phase_time'] - df['begin_time']).dt.total_seconds().astype(float)  
 
-# Separate P and S waves into different dataframes  
-df_p = df[df['phase_type'] == 'P'].set_index('file_name')  
-df_s = df[df['phase_type'] == 'S'].set_index('file_name')  
+# t1 (P wave) and t2 (S wave) of every file, one row per file  
+picks = (2 * df.pivot(index='file_name', columns='phase_type', values='time_diff')).reindex(columns=['P', 'S'])  
+picks.columns = ['t1', 't2']  
 
 # Create a new directory for updated SAC files  
 new_sac_folder = './CAP_6Outlier_3SAC'  
@@ -23,60 +23,38 @@ os.makedirs(new_sac_folder, exist_ok=True)
 
 # Create the results subdirectory  
 results_folder = os.path.join(new_sac_folder, 'results')  
-os.makedirs(results_folder, exist_ok=True)   
-
-# Prepare a list to store results for CSV output  
-results = []  
+os.makedirs(results_folder, exist_ok=True)  
 
 # Path to the original SAC files  
 sac_folder = './CAP_5Filter_3SAC'  
-for root, dirs, files in os.walk(sac_folder):  
-    for file in files:  
-        if file.endswith('.SAC'):  
-            file_path = os.path.join(root, file)  
-            new_file_path = os.path.join(new_sac_folder, file)  
-            
-            # Copy SAC file to the new directory  
-            shutil.copy2(file_path, new_file_path)  
-            
-            # Read the newly copied SAC file  
-            st = read(new_file_path)  
-            tr = st[0]  
-            
-            # Initialize t1 and t2 values  
-            t1_value = None  
-            t2_value = None  
-            
-            # Update t1 (P wave) and t2 (S wave) if applicable  
-            if file in df_p.index:  
-                t1_value = 2 * float(df_p.loc[file, 'time_diff'])  
-                print(f'Updating {file}: t1 = {t1_value}')  
-                tr.stats.sac.t1 = t1_value  
-            
-            if file in df_s.index:  
-                t2_value = 2 * float(df_s.loc[file, 'time_diff'])  
-                print(f'Updating {file}: t2 = {t2_value}')  
-                tr.stats.sac.t2 = t2_value  
-
-            # Save the updated SAC file  
-            tr.write(new_file_path, format='SAC')  
-
-            # Append results to the list  
-            results.append({  
-                'file_name': file,  
-                't1': t1_value,  
-                't2': t2_value  
-            })  
-
-# Convert results to DataFrame  
-results_df = pd.DataFrame(results)  
+sac_files = [  
+    (file, os.path.join(root, file))  
+    for root, dirs, files in os.walk(sac_folder)  
+    for file in files  
+    if file.endswith('.SAC')  
+]  
+sac_files = pd.DataFrame(sac_files, columns=['file_name', 'path'])  
+
+# Look up the picks of all files in one merge  
+results_df = sac_files.merge(picks, left_on='file_name', right_index=True, how='left')  
+
+# Header values to write: (file, field, value), without the missing phases  
+updates = results_df.melt(id_vars=['path'], value_vars=['t1', 't2'], var_name='field').dropna(subset=['value'])  
+updates = updates.rename(columns={'path': 'file'})  
+
+# Copy-on-write clones of the files without picks, then clone and patch  
+# only the t1/t2 header words of the others  
+for path in results_df.loc[results_df[['t1', 't2']].isna().all(axis=1), 'path']:  
+    clone_file(path, os.path.join(new_sac_folder, os.path.basename(path)))  
+written = patch_headers(updates, output_dir=new_sac_folder)  
+print(f"Updated {int(np.sum(written))} of {len(updates)} header values (t1/t2) in {updates['file'].nunique()} SAC files")  
 
 # Sort by t1 and t2  
-results_df = results_df.sort_values(by=['t1', 't2'])  
+results_df = results_df[['file_name', 't1', 't2']].sort_values(by=['t1', 't2'])  
 
 # Save results to CSV  
 output_csv_path = os.path.join(results_folder, 'sac_file_updates.csv')  
 results_df.to_csv(output_csv_path, index=False)  
 
 print(f"All SAC files have been copied and header variables updated. New files are saved in the CAP_6Outlier_3SAC directory.")  
-print(f"Results saved to {output_csv_path}.")
\ No newline at end of file
+print(f"Results saved to {output_csv_path}.")  
@@ -0,0 +1,98 @@
+###############################################################################
+# Description:
+# Benchmark of the minimum inter-event gap declustering:
+# the former strptime/tuple-sort loop vs catlog_utils.convert_csv_to_custom_format
+# Usage: python benchmarks/bench_decluster.py [n_events] [gap_minutes]
+###############################################################################
+import csv
+import filecmp
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from catlog_utils import convert_csv_to_custom_format
+
+###############################################################################
+def legacy_convert(input_file, output_file, min_gap):
+    data = []
+    with open(input_file, "r", encoding="utf-8") as infile:
+        csvreader = csv.reader(infile)
+        next(csvreader)
+        events = []
+        for row in csvreader:
+            try:
+                events.append((datetime.strptime(row[0], "%Y-%m-%dT%H:%M:%S.%fZ"), row))
+            except ValueError:
+                continue
+    events.sort(key=lambda x: x[0])
+
+    last_kept_time = None
+    for time_obj, row in events:
+        if last_kept_time is None or (time_obj - last_kept_time) >= min_gap:
+            time_str, lat, lon, depth, magnitude, mag_type = row
+            new_time_str = time_obj.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+            output_row = ["xxxxx", new_time_str, lat, lon, depth, "xxxx", "yyyyy", mag_type, magnitude, " "]
+            data.append((time_obj, output_row))
+            last_kept_time = time_obj
+    data.sort(key=lambda x: x[0], reverse=True)
+
+    with open(output_file, "w", newline="", encoding="utf-8") as outfile:
+        csvwriter = csv.writer(outfile)
+        for _, output_row in data:
+            csvwriter.writerow(output_row)
+
+
+def synthetic_csv(path, n, seed=0):
+    # Clustered origin times over ~10 years with duplicates, shuffled order
+    rng = np.random.default_rng(seed)
+    t0 = np.datetime64("2010-01-01T00:00:00", "ms")
+    offsets = np.cumsum(rng.exponential(600_000, n).astype(np.int64))
+    offsets[rng.random(n) < 0.05] = offsets[0]
+    times = pd.Series(t0 + offsets.astype("timedelta64[ms]")).dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    df = pd.DataFrame(
+        {
+            "Time": times,
+            "Latitude": rng.uniform(36, 40, n).round(4),
+            "Longitude": rng.uniform(32, 37, n).round(4),
+            "Depth": rng.uniform(1, 20, n).round(1),
+            "Magnitude": rng.uniform(1.5, 3.5, n).round(1),
+            "Magnitude_type": "ML",
+        }
+    ).sample(frac=1, random_state=seed)
+    df.to_csv(path, index=False)
+
+
+def run(n, gap_minutes):
+    min_gap = timedelta(minutes=gap_minutes)
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = os.path.join(tmp, "events.csv")
+        synthetic_csv(csv_file, n)
+
+        t0 = time.perf_counter()
+        legacy_convert(csv_file, os.path.join(tmp, "legacy.txt"), min_gap)
+        t_legacy = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        convert_csv_to_custom_format(csv_file, os.path.join(tmp, "vector.txt"), min_gap=min_gap,
+                                     chunksize=max(n // 10, 1))
+        t_vector = time.perf_counter() - t0
+
+        same = filecmp.cmp(os.path.join(tmp, "legacy.txt"), os.path.join(tmp, "vector.txt"), shallow=False)
+        assert same, "outputs differ"
+        print(
+            f"n={n:<10d} gap={gap_minutes} min  legacy {t_legacy:8.3f} s  "
+            f"vectorized {t_vector:8.3f} s  speed-up {t_legacy / t_vector:6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 500000,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 20,
+    )
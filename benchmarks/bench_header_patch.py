@@ -0,0 +1,68 @@
+###############################################################################
+# Description:
+# Benchmark of bulk t1/t2 header updates as in 6_3c_change_header.py:
+# copy + obspy.read + write of every trace vs sac_io.patch_headers, which
+# clones the files and writes only the affected header words through a
+# memory map, on synthetic 3-minute 100 Hz traces
+# Usage: python benchmarks/bench_header_patch.py [n_files]
+###############################################################################
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from obspy import read
+from obspy.io.sac import SACTrace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_sac_io import synthetic_sac_files
+from sac_io import patch_headers, read_sac_headers
+
+###############################################################################
+def run(n):
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        src_dir, obspy_dir, patch_dir = (os.path.join(tmp, name) for name in ("src", "obspy", "patch"))
+        for directory in (src_dir, obspy_dir, patch_dir):
+            os.makedirs(directory)
+        paths = synthetic_sac_files(src_dir, n)
+        t1 = rng.uniform(1.0, 20.0, n).round(2)
+        t2 = t1 + rng.uniform(1.0, 20.0, n).round(2)
+
+        t0 = time.perf_counter()
+        for path, p_time, s_time in zip(paths, t1, t2):
+            new_path = os.path.join(obspy_dir, os.path.basename(path))
+            shutil.copy2(path, new_path)
+            tr = read(new_path)[0]
+            tr.stats.sac.t1 = p_time
+            tr.stats.sac.t2 = s_time
+            tr.write(new_path, format="SAC")
+        t_obspy = time.perf_counter() - t0
+
+        updates = {
+            "file": np.concatenate([paths, paths]),
+            "field": np.repeat(["t1", "t2"], n),
+            "value": np.concatenate([t1, t2]),
+        }
+        t0 = time.perf_counter()
+        written = patch_headers(updates, output_dir=patch_dir)
+        t_patch = time.perf_counter() - t0
+
+        assert written.all()
+        patched = [os.path.join(patch_dir, os.path.basename(path)) for path in paths]
+        headers, valid = read_sac_headers(patched)
+        assert valid.all()
+        np.testing.assert_array_equal(headers["t1"], t1.astype(np.float32))
+        np.testing.assert_array_equal(headers["t2"], t2.astype(np.float32))
+        sac = SACTrace.read(patched[-1])
+        np.testing.assert_array_equal(sac.data, SACTrace.read(paths[-1]).data)
+        print(
+            f"n={n:<8d} copy+obspy read/write {t_obspy:8.3f} s  patch_headers {t_patch:8.3f} s  "
+            f"speed-up {t_obspy / t_patch:6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
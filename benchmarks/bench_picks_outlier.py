@@ -0,0 +1,144 @@
+###############################################################################
+# Description:
+# Benchmark of the pick table of 8_3c_picks_outlier.ipynb: obspy.read of
+# every file for o, t1, t2 and dist vs picks_outlier.pick_table (header
+# bytes only, on a thread pool), and the time of the std_dev / huber /
+# ransac fits per station, on synthetic 3-minute 100 Hz traces. Known
+# outliers are planted in the pick table and must be flagged by every
+# method, also inside an event too small for its own line, and the Huber
+# lines are checked against a direct minimization of the Huber loss
+# (scipy.optimize)
+# Usage: python benchmarks/bench_picks_outlier.py [n_files]
+###############################################################################
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from obspy import read
+from scipy.optimize import minimize
+from scipy.special import huber
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_sac_io import synthetic_sac_files
+from bench_snr import set_arrivals
+from picks_outlier import COLUMNS, HUBER_EPSILON, MAD_SCALE, METHODS, classify_picks, fit_lines, pick_table
+
+###############################################################################
+def legacy_table(paths):
+    rows = []
+    for path in paths:
+        sac = read(path)[0].stats.sac
+        t1_minus_o, t2_minus_o = sac.t1 - sac.o, sac.t2 - sac.o
+        if t1_minus_o > 0 and t2_minus_o > 0:
+            rows.append((os.path.basename(path), sac.dist, t1_minus_o, t2_minus_o))
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def plant_outliers(table, seed=2):
+    # Picking noise on every row, then late S picks (3% of the rows) and
+    # early P picks (2%) at random rows; returns the table and the planted
+    # mask. Few, large offsets, so that the residual standard deviation of
+    # std_dev is not inflated past them
+    rng = np.random.default_rng(seed)
+    table = table.copy()
+    n = len(table)
+    table["t1_minus_O"] += rng.normal(0.0, 0.1, n)
+    table["t2_minus_O"] += rng.normal(0.0, 0.2, n)
+    late_s = rng.choice(n, n * 3 // 100, replace=False)
+    early_p = rng.choice(n, n * 2 // 100, replace=False)
+    table.loc[late_s, "t2_minus_O"] += rng.uniform(20.0, 30.0, len(late_s))
+    table.loc[early_p, "t1_minus_O"] -= rng.uniform(10.0, 20.0, len(early_p))
+    planted = np.zeros(n, dtype=bool)
+    planted[late_s] = planted[early_p] = True
+    return table, planted
+
+
+def small_event_table(n_events=30, seed=3):
+    # Picks of n_events events, three identical rows (BHE/BHN/BHZ) per
+    # event-station; event E07 has only two stations, one with a +10 s S
+    # pick. Returns the table and the planted file names
+    rng = np.random.default_rng(seed)
+    rows = []
+    for event in range(n_events):
+        n_stations = 2 if event == 7 else rng.integers(6, 20)
+        for station in range(n_stations):
+            dist = rng.uniform(10.0, 100.0)
+            t1 = dist / 6.0 + rng.normal(0.0, 0.1)
+            t2 = dist / 3.5 + rng.normal(0.0, 0.2) + (10.0 if event == 7 and station == 0 else 0.0)
+            for component in ("BHE", "BHN", "BHZ"):
+                rows.append((f"E{event:02d}.S{station:02d}.{component}.SAC", dist, t1, t2, f"E{event:02d}"))
+    planted = {f"E07.S00.{component}.SAC" for component in ("BHE", "BHN", "BHZ")}
+    return pd.DataFrame(rows, columns=COLUMNS + ["Event"]), planted
+
+
+def reference_huber(x, y, epsilon=HUBER_EPSILON):
+    # Huber line minimizing sum(huber(epsilon, r / s)) with scipy, at the
+    # robust residual scale s of the fit_huber line
+    slope, intercept, _ = fit_lines(x, y, None, "huber", epsilon=epsilon)
+    scale = MAD_SCALE * np.median(np.abs(y - (slope[0] * x + intercept[0])))
+    result = minimize(
+        lambda p: huber(epsilon, (y - p[0] * x - p[1]) / scale).sum(),
+        np.polyfit(x, y, 1),
+        method="Nelder-Mead",
+        options={"xatol": 1e-10, "fatol": 1e-12, "maxiter": 10000},
+    )
+    return (slope[0], intercept[0]), tuple(result.x)
+
+
+def run(n):
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = sorted(synthetic_sac_files(tmp, n))
+        set_arrivals(paths)
+
+        t0 = time.perf_counter()
+        legacy = legacy_table(paths)
+        t_legacy = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        table = pick_table(tmp)
+        t_table = time.perf_counter() - t0
+
+        pd.testing.assert_frame_equal(table[COLUMNS], legacy, check_dtype=False)
+        print(
+            f"n={n:<8d} obspy.read {t_legacy:8.3f} s  pick_table {t_table:8.3f} s  "
+            f"speed-up {t_legacy / t_table:6.1f}x"
+        )
+        # The synthetic file names carry no event; group by station instead,
+        # about 200 picks per station
+        table["Station"] = np.arange(len(table)) % max(1, len(table) // 200)
+        table, planted = plant_outliers(table)
+        planted_files = set(table["Filename"][planted])
+        for method in METHODS:
+            t0 = time.perf_counter()
+            normal_df, outlier_df, fits = classify_picks(table, method, by="Station")
+            elapsed = time.perf_counter() - t0
+            flagged = set(outlier_df["Filename"])
+            assert planted_files <= flagged, f"{method}: {len(planted_files - flagged)} planted outliers missed"
+            print(
+                f"  {method:8s} {len(fits)} lines {elapsed:8.3f} s  outliers {len(flagged)} "
+                f"(planted {len(planted_files)}, false positives {len(flagged - planted_files)})"
+            )
+
+        # A two-station event is judged against the line of all events
+        events, planted_files = small_event_table()
+        for method in METHODS:
+            _, outlier_df, _ = classify_picks(events, method, by="Event")
+            flagged = set(outlier_df["Filename"])
+            assert planted_files <= flagged, f"{method}: planted outlier of the two-station event missed"
+            print(f"  {method:8s} by Event, two-station event: planted outlier flagged ({len(flagged)} outliers)")
+
+        x = table["Distance"].to_numpy()
+        for phase in ("t1", "t2"):
+            fit, reference = reference_huber(x, table[f"{phase}_minus_O"].to_numpy())
+            np.testing.assert_allclose(fit, reference, rtol=1e-5, atol=1e-5)
+            print(
+                f"  huber {phase} slope {fit[0]:.6f} intercept {fit[1]:.6f}  "
+                f"scipy.optimize slope {reference[0]:.6f} intercept {reference[1]:.6f}"
+            )
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
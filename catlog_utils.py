@@ -0,0 +1,239 @@
+###############################################################################
+# Description:
+# Shared helpers for building and filtering the seismic event catalog
+# used by 0_KOERI_catlog.py and 0_event_catlog_acquire.py
+###############################################################################
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry.base import BaseGeometry
+
+###############################################################################
+if hasattr(shapely, "contains_xy"):
+    # shapely >= 2.0
+    _contains_xy = shapely.contains_xy
+else:
+    from shapely.vectorized import contains as _contains_xy
+
+
+def points_in_polygons(lon, lat, polygons):
+    # Bulk point-in-polygon test on whole longitude/latitude columns
+    # polygons: a Polygon/MultiPolygon or a list of them; a point is selected
+    # if it lies inside any of them. Same semantics as polygon.contains(Point),
+    # so points exactly on a boundary are not selected.
+    if isinstance(polygons, BaseGeometry):
+        polygons = [polygons]
+
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    mask = np.zeros(lon.shape, dtype=bool)
+
+    for polygon in polygons:
+        # Cheap bounding-box prefilter before the exact test
+        minx, miny, maxx, maxy = polygon.bounds
+        in_box = (lon >= minx) & (lon <= maxx) & (lat >= miny) & (lat <= maxy)
+        in_box &= ~mask
+        if in_box.any():
+            idx = np.flatnonzero(in_box)
+            mask[idx] = _contains_xy(polygon, lon[idx], lat[idx])
+
+    return mask
+
+
+###############################################################################
+# Binary columnar catalog
+# The .par text file stays the export format for MuRAT; next to it a NumPy
+# structured array (.npy) is written with every column already parsed, so the
+# pipeline steps load the whole catalog with a single np.load
+CATLOG_DTYPE = np.dtype(
+    [
+        ("name", "U16"),  # event directory, e.g. 20150510.23.58
+        ("ymd", "U8"),
+        ("hour", "U2"),
+        ("mini", "U2"),
+        ("msec", "U8"),  # seconds with fraction, as written in the .par
+        ("epoch", "f8"),  # origin time, POSIX seconds (UTC)
+        ("year", "i2"),
+        ("julday", "i2"),
+        ("lat", "f8"),
+        ("lon", "f8"),
+        ("depth", "f8"),
+        ("mag", "f8"),
+    ]
+)
+
+
+def catlog_npy_path(par_file):
+    return os.path.splitext(par_file)[0] + ".npy"
+
+
+def read_par_catlog(par_file):
+    # Parse a .par catalog into a CATLOG_DTYPE array with one vectorized read
+    try:
+        par = pd.read_csv(par_file, sep=r"\s+", header=None, dtype=str)
+    except pd.errors.EmptyDataError:
+        return np.empty(0, dtype=CATLOG_DTYPE)
+
+    origin = pd.to_datetime(
+        par[1] + " " + par[2] + ":" + par[3] + ":" + par[4], format="%Y%m%d %H:%M:%S.%f"
+    )
+
+    catlog = np.empty(len(par), dtype=CATLOG_DTYPE)
+    catlog["name"] = par[0]
+    catlog["ymd"] = par[1]
+    catlog["hour"] = par[2]
+    catlog["mini"] = par[3]
+    catlog["msec"] = par[4]
+    catlog["epoch"] = (origin - pd.Timestamp("1970-01-01")).dt.total_seconds()
+    catlog["year"] = origin.dt.year
+    catlog["julday"] = origin.dt.dayofyear
+    catlog["lat"] = par[5].astype(float)
+    catlog["lon"] = par[6].astype(float)
+    catlog["depth"] = par[7].astype(float)
+    catlog["mag"] = par[10].astype(float)
+    return catlog
+
+
+def save_catlog(catlog, npy_file):
+    np.save(npy_file, catlog, allow_pickle=False)
+    return npy_file
+
+
+def write_catlog_npy(par_file):
+    # Write the binary twin of a .par catalog, e.g. catlog/KOERI_catlog.npy
+    return save_catlog(read_par_catlog(par_file), catlog_npy_path(par_file))
+
+
+def load_catlog(par_file):
+    # Load a catalog by its .par path. The .npy twin is used when it is at
+    # least as new as the .par, so hand edits of the .par are never ignored
+    npy_file = catlog_npy_path(par_file)
+    if os.path.exists(npy_file) and (
+        not os.path.exists(par_file) or os.path.getmtime(npy_file) >= os.path.getmtime(par_file)
+    ):
+        return np.load(npy_file, allow_pickle=False)
+    return read_par_catlog(par_file)
+
+
+def format_par_line(event):
+    # One catalog record back in the .par layout written by parse_custom_format
+    return "%-11s %-9s %-3s %-3s %-8s %-10s %-10s %-4s  8.4 25.6   %3s  ML" % (
+        event["name"],
+        event["ymd"],
+        event["hour"],
+        event["mini"],
+        event["msec"],
+        str(float(event["lat"])),
+        str(float(event["lon"])),
+        str(float(event["depth"])),
+        str(float(event["mag"])),
+    )
+
+
+###############################################################################
+# Minimum inter-event gap declustering
+def decluster_min_gap(times, min_gap):
+    # Keep mask for chronologically sorted int64 times (ns): an event is kept
+    # if it is at least min_gap after the last kept event.
+    # Any event at least min_gap after its predecessor is always kept, so the
+    # catalog splits into independent clusters. Inside the clusters the kept
+    # chain is followed for all clusters at once, one kept event per step.
+    times = np.asarray(times, dtype=np.int64)
+    gap = np.int64(pd.Timedelta(min_gap).value)
+    n = len(times)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+
+    # First later event at least min_gap after each event (with a zero gap,
+    # the next one, so the chain always moves on)
+    next_kept = np.maximum(np.searchsorted(times, times + gap, side="left"), np.arange(1, n + 1))
+
+    cur = np.flatnonzero(np.r_[True, np.diff(times) >= gap])
+    cur_end = np.r_[cur[1:], n]
+    while cur.size:
+        keep[cur] = True
+        cur = next_kept[cur]
+        inside = cur < cur_end
+        cur, cur_end = cur[inside], cur_end[inside]
+    return keep
+
+
+def _read_catlog_csv(input_file, chunksize, usecols=range(6)):
+    # Stream the catalog CSV (Time, Latitude, Longitude, Depth, Magnitude,
+    # Magnitude_type) as text so the values are written back unchanged
+    return pd.read_csv(
+        input_file,
+        dtype=str,
+        keep_default_na=False,
+        usecols=usecols,
+        chunksize=chunksize,
+    )
+
+
+def _parse_times(time_str):
+    # ISO 8601 times with a trailing Z, e.g. 2013-05-20T11:25:27.170000Z, to int64 ns.
+    # NumPy's C parser handles the common case; rows it cannot read fall back to
+    # pandas with an explicit format, and unparsable rows become NaT
+    try:
+        if time_str.str.endswith("Z").all():
+            times = np.asarray(time_str.str[:-1].to_numpy(dtype=str), dtype="datetime64[ns]")
+            return times.view(np.int64)
+    except ValueError:
+        pass
+    times = pd.to_datetime(time_str, format="%Y-%m-%dT%H:%M:%S.%fZ", errors="coerce")
+    for value in time_str[times.isna()]:
+        print(f"Time format error for row with time: {value}")
+    return times.to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+
+def convert_csv_to_custom_format(input_file, output_file, min_gap=pd.Timedelta(minutes=20),
+                                 chunksize=1_000_000):
+    # Convert the CSV file to the custom .txt catalog format, keeping events at
+    # least min_gap apart. The CSV is read twice in chunks: once for the times
+    # only, once to pick up the kept rows, so memory stays flat on large catalogs
+    times = [
+        _parse_times(chunk.iloc[:, 0])
+        for chunk in _read_catlog_csv(input_file, chunksize, usecols=[0])
+    ]
+    times = np.concatenate(times) if times else np.empty(0, dtype=np.int64)
+
+    valid = np.flatnonzero(times != np.iinfo(np.int64).min)  # NaT rows are dropped
+    order = valid[np.argsort(times[valid], kind="stable")]
+    kept_rows = np.sort(order[decluster_min_gap(times[order], min_gap)])
+
+    kept = []
+    offset = 0
+    for chunk in _read_catlog_csv(input_file, chunksize):
+        lo, hi = np.searchsorted(kept_rows, [offset, offset + len(chunk)])
+        rows = kept_rows[lo:hi]
+        selected = chunk.iloc[rows - offset].copy()
+        selected["time_ns"] = times[rows]
+        kept.append(selected)
+        offset += len(chunk)
+    if not kept:
+        open(output_file, "w").close()
+        return
+
+    kept = pd.concat(kept).sort_values("time_ns", ascending=False, kind="stable")
+    time_str = pd.to_datetime(kept["time_ns"]).dt.strftime("%Y-%m-%d %H:%M:%S.%f").str[:-3]
+
+    # This my custom catlog format following the our group tradition
+    # Change and replace the placeholders if you want
+    out = pd.DataFrame(
+        {
+            "id": "xxxxx",  # Placeholder for the first column
+            "time": time_str.to_numpy(),  # Formatted time
+            "lat": kept.iloc[:, 1].to_numpy(),
+            "lon": kept.iloc[:, 2].to_numpy(),
+            "depth": kept.iloc[:, 3].to_numpy(),
+            "p1": "xxxx",  # Placeholder
+            "p2": "yyyyy",  # Placeholder
+            "mag_type": kept.iloc[:, 5].to_numpy(),
+            "magnitude": kept.iloc[:, 4].to_numpy(),
+            "p3": " ",  # Placeholder
+        }
+    )
+    out.to_csv(output_file, header=False, index=False, lineterminator="\r\n")
@@ -9,9 +9,11 @@ import numpy as np
 import pandas as pd
 
 pd.options.mode.chained_assignment = None
+import glob
 import json
 import random
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 # import s3fs
 import h5py
@@ -147,6 +149,138 @@ def normalize_batch(data, window=3000):
     return data
 
 
+def read_stream(stream, response=None, highpass_filter=0.0, sampling_rate=100):
+    """Model input of an ObsPy stream of one or more stations (modified in place).
+    Returns {"data": [nt, nsta, 3], "t0": ..., "station_id": [nsta]}, or {} if unusable
+    """
+    try:
+        stream = stream.merge(fill_value="latest")
+        if response is not None:
+            # response = obspy.read_inventory(response_xml)
+            stream = stream.remove_sensitivity(response)
+    except Exception as e:
+        print(f"Error merging {stream}:\n{e}")
+        return {}
+    tmp_stream = obspy.Stream()
+    for trace in stream:
+        if len(trace.data) < 10:
+            continue
+
+        ## interpolate to 100 Hz
+        if abs(trace.stats.sampling_rate - sampling_rate) > 0.1:
+            logging.warning(f"Resampling {trace.id} from {trace.stats.sampling_rate} to {sampling_rate} Hz")
+            try:
+                trace = trace.interpolate(sampling_rate, method="linear")
+            except Exception as e:
+                print(f"Error resampling {trace.id}:\n{e}")
+
+        trace = trace.detrend("demean")
+
+        ## highpass filtering > 1Hz
+        if highpass_filter > 0.0:
+            trace = trace.filter("highpass", freq=highpass_filter)
+
+        tmp_stream.append(trace)
+
+    if len(tmp_stream) == 0:
+        return {}
+    stream = tmp_stream
+
+    begin_time = min([st.stats.starttime for st in stream])
+    end_time = max([st.stats.endtime for st in stream])
+    stream = stream.trim(begin_time, end_time, pad=True, fill_value=0)
+
+    comp = ["3", "2", "1", "E", "N", "U", "V", "Z"]
+    order = {key: i for i, key in enumerate(comp)}
+    comp2idx = {
+        "3": 0,
+        "2": 1,
+        "1": 2,
+        "E": 0,
+        "N": 1,
+        "Z": 2,
+        "U": 0,
+        "V": 1,
+    }  ## only for cases less than 3 components
+
+    station_ids = defaultdict(list)
+    for tr in stream:
+        station_ids[tr.id[:-1]].append(tr.id[-1])
+        if tr.id[-1] not in comp:
+            print(f"Unknown component {tr.id[-1]}")
+
+    station_keys = sorted(list(station_ids.keys()))
+
+    nx = len(station_ids)
+    nt = len(stream[0].data)
+    data = np.zeros([3, nt, nx], dtype=np.float32)
+    for i, sta in enumerate(station_keys):
+        for j, c in enumerate(sorted(station_ids[sta], key=lambda x: order[x])):
+            if len(station_ids[sta]) != 3:  ## less than 3 component
+                j = comp2idx[c]
+
+            if len(stream.select(id=sta + c)) == 0:
+                print(f"Empty trace: {sta+c} {begin_time}")
+                continue
+
+            trace = stream.select(id=sta + c)[0]
+
+            ## accerleration to velocity
+            if sta[-1] == "N":
+                trace = trace.integrate().filter("highpass", freq=1.0)
+
+            tmp = trace.data.astype("float32")
+            data[j, : len(tmp), i] = tmp[:nt]
+
+    # if return_single_station and (len(station_keys) > 1):
+    #     print(f"Warning: {fname} has multiple stations, returning only the first one {station_keys[0]}")
+    #     data = data[:, :, 0:1]
+    #     station_keys = station_keys[0:1]
+
+    meta = {
+        "data": data.transpose([1, 2, 0]),
+        "t0": begin_time.datetime.isoformat(timespec="milliseconds"),
+        "station_id": station_keys,
+    }
+    return meta
+
+
+def read_file_group(fname, data_dir="", response=None, highpass_filter=0.0, sampling_rate=100):
+    """Read the files of one group (file name or glob pattern, e.g. "NET.STA.2014-01-01T00:00.BH*").
+    Returns (source files, meta) with meta as read_stream"""
+    files = sorted(glob.glob(os.path.join(data_dir, fname)))
+    stream = obspy.Stream()
+    for file in files:
+        try:
+            stream += obspy.read(file)
+        except Exception as e:
+            print(f"Error reading {file}:\n{e}")
+    if len(stream) == 0:
+        return files, {}
+    return files, read_stream(stream, response=response, highpass_filter=highpass_filter, sampling_rate=sampling_rate)
+
+
+def write_hdf5_bundle(file_groups, data_dir, hdf5_file, hdf5_group="data", workers=4, **kwargs):
+    """Pack every file group into one dataset of hdf5_file/hdf5_group, named after the group:
+    data [nt, nsta, 3] already merged, trimmed and aligned by read_stream, with attrs
+    t0, station_id and source_files. DataReader_pred reads it with format="hdf5".
+    kwargs go to read_stream (response, highpass_filter, sampling_rate). Returns the names written"""
+    names = []
+    with h5py.File(hdf5_file, "w", libver="latest") as h5, ThreadPoolExecutor(max_workers=workers) as executor:
+        group = h5.create_group(hdf5_group)
+        reads = executor.map(lambda fname: read_file_group(fname, data_dir, **kwargs), file_groups)
+        for fname, (files, meta) in zip(file_groups, tqdm(reads, total=len(file_groups), desc="Bundle")):
+            if "data" not in meta:
+                logging.warning(f"No usable data in {fname}")
+                continue
+            ds = group.create_dataset(fname, data=meta["data"])
+            ds.attrs["t0"] = meta["t0"]
+            ds.attrs["station_id"] = meta["station_id"]
+            ds.attrs["source_files"] = [os.path.basename(file) for file in files]
+            names.append(fname)
+    return names
+
+
 class DataConfig:
     seed = 123
     use_seed = True
@@ -295,6 +429,8 @@ class DataReader:
                 meta["its"] = attrs["its"]
         if "t0" in attrs:
             meta["t0"] = attrs["t0"]
+        if "station_id" in attrs:
+            meta["station_id"] = [x.decode() if isinstance(x, bytes) else x for x in np.atleast_1d(attrs["station_id"])]
         return meta
 
     def read_s3(self, format, fname, bucket, key, secret, s3_url, use_ssl):
@@ -310,95 +446,10 @@ class DataReader:
     def read_mseed(self, fname, response=None, highpass_filter=0.0, sampling_rate=100, return_single_station=True):
         try:
             stream = obspy.read(fname)
-            stream = stream.merge(fill_value="latest")
-            if response is not None:
-                # response = obspy.read_inventory(response_xml)
-                stream = stream.remove_sensitivity(response)
         except Exception as e:
             print(f"Error reading {fname}:\n{e}")
             return {}
-        tmp_stream = obspy.Stream()
-        for trace in stream:
-            if len(trace.data) < 10:
-                continue
-
-            ## interpolate to 100 Hz
-            if abs(trace.stats.sampling_rate - sampling_rate) > 0.1:
-                logging.warning(f"Resampling {trace.id} from {trace.stats.sampling_rate} to {sampling_rate} Hz")
-                try:
-                    trace = trace.interpolate(sampling_rate, method="linear")
-                except Exception as e:
-                    print(f"Error resampling {trace.id}:\n{e}")
-
-            trace = trace.detrend("demean")
-
-            ## highpass filtering > 1Hz
-            if highpass_filter > 0.0:
-                trace = trace.filter("highpass", freq=highpass_filter)
-
-            tmp_stream.append(trace)
-
-        if len(tmp_stream) == 0:
-            return {}
-        stream = tmp_stream
-
-        begin_time = min([st.stats.starttime for st in stream])
-        end_time = max([st.stats.endtime for st in stream])
-        stream = stream.trim(begin_time, end_time, pad=True, fill_value=0)
-
-        comp = ["3", "2", "1", "E", "N", "U", "V", "Z"]
-        order = {key: i for i, key in enumerate(comp)}
-        comp2idx = {
-            "3": 0,
-            "2": 1,
-            "1": 2,
-            "E": 0,
-            "N": 1,
-            "Z": 2,
-            "U": 0,
-            "V": 1,
-        }  ## only for cases less than 3 components
-
-        station_ids = defaultdict(list)
-        for tr in stream:
-            station_ids[tr.id[:-1]].append(tr.id[-1])
-            if tr.id[-1] not in comp:
-                print(f"Unknown component {tr.id[-1]}")
-
-        station_keys = sorted(list(station_ids.keys()))
-
-        nx = len(station_ids)
-        nt = len(stream[0].data)
-        data = np.zeros([3, nt, nx], dtype=np.float32)
-        for i, sta in enumerate(station_keys):
-            for j, c in enumerate(sorted(station_ids[sta], key=lambda x: order[x])):
-                if len(station_ids[sta]) != 3:  ## less than 3 component
-                    j = comp2idx[c]
-
-                if len(stream.select(id=sta + c)) == 0:
-                    print(f"Empty trace: {sta+c} {begin_time}")
-                    continue
-
-                trace = stream.select(id=sta + c)[0]
-
-                ## accerleration to velocity
-                if sta[-1] == "N":
-                    trace = trace.integrate().filter("highpass", freq=1.0)
-
-                tmp = trace.data.astype("float32")
-                data[j, : len(tmp), i] = tmp[:nt]
-
-        # if return_single_station and (len(station_keys) > 1):
-        #     print(f"Warning: {fname} has multiple stations, returning only the first one {station_keys[0]}")
-        #     data = data[:, :, 0:1]
-        #     station_keys = station_keys[0:1]
-
-        meta = {
-            "data": data.transpose([1, 2, 0]),
-            "t0": begin_time.datetime.isoformat(timespec="milliseconds"),
-            "station_id": station_keys,
-        }
-        return meta
+        return read_stream(stream, response=response, highpass_filter=highpass_filter, sampling_rate=sampling_rate)
 
     def read_mseed_3c(self, fname, response=None, highpass_filter=0.0, sampling_rate=100):
         try:
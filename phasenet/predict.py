@@ -4,13 +4,15 @@ import multiprocessing
 import os
 import pickle
 import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 import h5py
 import numpy as np
+import obspy
 import pandas as pd
 import tensorflow as tf
-from data_reader import DataReader_mseed_array, DataReader_pred
+from data_reader import DataReader_mseed_array, DataReader_pred, normalize_long, read_file_group, read_stream
 from model import ModelConfig, UNet
 from postprocess import (
     extract_amplitude,
@@ -56,6 +58,30 @@ def read_args():
     return args
 
 
+def picks_dataframe(picks, amplitude=False):
+    # df["fname"] = df["file_name"]
+    # df["id"] = df["station_id"]
+    # df["timestamp"] = df["phase_time"]
+    # df["prob"] = df["phase_prob"]
+    # df["type"] = df["phase_type"]
+    base_columns = [
+        "station_id",
+        "begin_time",
+        "phase_index",
+        "phase_time",
+        "phase_score",
+        "phase_type",
+        "file_name",
+    ]
+    if amplitude:
+        base_columns.append("phase_amplitude")
+        base_columns.append("phase_amp")
+    df = pd.DataFrame(picks, columns=base_columns[:-1] if amplitude else base_columns)
+    if amplitude:
+        df["phase_amp"] = df["phase_amplitude"]
+    return df[base_columns]
+
+
 def pred_fn(args, data_reader, figure_dir=None, prob_dir=None, log_dir=None):
     current_time = time.strftime("%y%m%d-%H%M%S")
     if log_dir is None:
@@ -194,28 +220,7 @@ def pred_fn(args, data_reader, figure_dir=None, prob_dir=None, log_dir=None):
         if len(picks) > 0:
             # save_picks(picks, args.result_dir, amps=amps, fname=args.result_fname+".csv")
             # save_picks_json(picks, args.result_dir, dt=data_reader.dt, amps=amps, fname=args.result_fname+".json")
-            df = pd.DataFrame(picks)
-            # df["fname"] = df["file_name"]
-            # df["id"] = df["station_id"]
-            # df["timestamp"] = df["phase_time"]
-            # df["prob"] = df["phase_prob"]
-            # df["type"] = df["phase_type"]
-
-            base_columns = [
-                "station_id",
-                "begin_time",
-                "phase_index",
-                "phase_time",
-                "phase_score",
-                "phase_type",
-                "file_name",
-            ]
-            if args.amplitude:
-                base_columns.append("phase_amplitude")
-                base_columns.append("phase_amp")
-                df["phase_amp"] = df["phase_amplitude"]
-
-            df = df[base_columns]
+            df = picks_dataframe(picks, amplitude=args.amplitude)
             df.to_csv(os.path.join(args.result_dir, args.result_fname + ".csv"), index=False)
 
             print(
@@ -226,6 +231,170 @@ def pred_fn(args, data_reader, figure_dir=None, prob_dir=None, log_dir=None):
     return 0
 
 
+###############################################################################
+# In-process API: one restored model per process, prediction on in-memory
+# streams or file groups in batches of equal-length windows, picks returned
+# as a DataFrame and figures rendered in a separate process pool
+PICK_PARAMS = {"min_p_prob": 0.3, "min_s_prob": 0.3, "mpd": 50, "pre_sec": 1, "post_sec": 4}
+_PICKERS = {}
+
+
+class Picker:
+    def __init__(self, model_dir, config=ModelConfig()):
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.model = UNet(config=config, mode="pred")
+            sess_config = tf.compat.v1.ConfigProto()
+            sess_config.gpu_options.allow_growth = True
+            self.sess = tf.compat.v1.Session(graph=self.graph, config=sess_config)
+            saver = tf.compat.v1.train.Saver(tf.compat.v1.global_variables())
+            self.sess.run(tf.compat.v1.global_variables_initializer())
+            latest_check_point = tf.train.latest_checkpoint(model_dir)
+            logging.info(f"restoring model {latest_check_point}")
+            saver.restore(self.sess, latest_check_point)
+
+    def predict(self, X):
+        """X: [batch, nt, nsta, 3] normalized samples -> [batch, nt, nsta, 3] probabilities (noise, P, S)"""
+        return self.sess.run(
+            self.model.preds,
+            feed_dict={self.model.X: X, self.model.drop_rate: 0, self.model.is_training: False},
+        )
+
+
+def get_picker(model_dir):
+    """The model restored from model_dir, loaded once per process"""
+    model_dir = os.path.abspath(model_dir)
+    if model_dir not in _PICKERS:
+        _PICKERS[model_dir] = Picker(model_dir)
+    return _PICKERS[model_dir]
+
+
+class FigureWriter:
+    """Renders plot_waveform figures in a process pool while prediction goes on.
+    close() (or leaving the with block) waits for the pending figures."""
+
+    def __init__(self, figure_dir, processes=None, dt=0.01):
+        os.makedirs(figure_dir, exist_ok=True)
+        self.figure_dir = figure_dir
+        self.dt = dt
+        self.pool = multiprocessing.get_context("spawn").Pool(processes)
+        self.jobs = []
+
+    def submit(self, data, pred, fname):
+        self.jobs.append(
+            self.pool.apply_async(plot_waveform, (data, pred, fname), {"figure_dir": self.figure_dir, "dt": self.dt})
+        )
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        for job in self.jobs:
+            try:
+                job.get()
+            except Exception as e:
+                logging.warning(f"Figure failed: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_sample(item, data_dir="", bundle=None, **kwargs):
+    """Read one input: an ObsPy Stream (copied), a file name / glob pattern of one file group,
+    or a dataset name of an HDF5 bundle (a DataReader_pred with format="hdf5").
+    Returns (file_name, meta), meta as DataReader.read_mseed"""
+    if bundle is not None:
+        return item, bundle.read_hdf5(item)
+    if isinstance(item, str):
+        _, meta = read_file_group(item, data_dir, **kwargs)
+        return item, meta
+    stream = obspy.Stream(list(item)).copy()
+    if len(stream) == 0:
+        return "", {}
+    return stream[0].id[:-1], read_stream(stream, **kwargs)
+
+
+def predict_picks(
+    inputs=None,
+    model_dir="model/190703-214543",
+    data_dir="",
+    hdf5_file=None,
+    hdf5_group="data",
+    batch_size=20,
+    amplitude=False,
+    highpass_filter=0.0,
+    response_xml=None,
+    sampling_rate=100,
+    figures=None,
+    workers=4,
+    **pick_params,
+):
+    """Pick P and S phases of many inputs in one process.
+    inputs: ObsPy Streams (or lists of Traces) and/or file names / glob patterns relative to data_dir,
+    each holding the components of one or more stations (e.g. "NET.STA.2014-01-01T00:00.BH*");
+    with hdf5_file, dataset names of a bundle written by write_hdf5_bundle (default: all of them).
+    Inputs of the same length are stacked into batches of batch_size; pick_params override PICK_PARAMS.
+    figures: optional FigureWriter, given the first station of every input.
+    Returns the picks as a DataFrame with the columns of the CLI picks.csv"""
+    config = argparse.Namespace(**{**PICK_PARAMS, **pick_params})
+    picker = get_picker(model_dir)
+    if hdf5_file is not None:
+        bundle = DataReader_pred(format="hdf5", hdf5_file=hdf5_file, hdf5_group=hdf5_group)
+        inputs = bundle.data_list if inputs is None else inputs
+        read = partial(load_sample, bundle=bundle)
+    else:
+        response = obspy.read_inventory(response_xml) if response_xml is not None else None
+        read = partial(
+            load_sample,
+            data_dir=data_dir,
+            response=response,
+            highpass_filter=highpass_filter,
+            sampling_rate=sampling_rate,
+        )
+
+    picks = []
+    chunk_size = batch_size * 4
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in tqdm(range(0, len(inputs), chunk_size), desc="Pred"):
+            # Group the readable inputs of this chunk by window shape
+            groups = {}
+            for file_name, meta in executor.map(read, inputs[start : start + chunk_size]):
+                if "data" not in meta:
+                    logging.warning(f"No usable data in {file_name}")
+                    continue
+                sample = normalize_long(meta["data"].copy())
+                sample[~np.isfinite(sample)] = 0
+                groups.setdefault(sample.shape, []).append((file_name, meta, sample))
+
+            for group in groups.values():
+                for i in range(0, len(group), batch_size):
+                    batch = group[i : i + batch_size]
+                    X = np.stack([sample for _, _, sample in batch])
+                    preds = picker.predict(X)
+                    raw = np.stack([meta["data"] for _, meta, _ in batch]) if amplitude else None
+                    picks.extend(
+                        extract_picks(
+                            preds=preds,
+                            file_names=[file_name for file_name, _, _ in batch],
+                            station_ids=[meta["station_id"] for _, meta, _ in batch],
+                            begin_times=[meta["t0"] for _, meta, _ in batch],
+                            config=config,
+                            waveforms=raw,
+                            use_amplitude=amplitude,
+                            dt=1.0 / sampling_rate,
+                        )
+                    )
+                    if figures is not None:
+                        for (file_name, _, sample), pred in zip(batch, preds):
+                            figures.submit(sample[:, :1, :], pred[:, :1, :], file_name)
+
+    if hdf5_file is not None:
+        bundle.h5.close()
+    return picks_dataframe(picks, amplitude=amplitude)
+
+
 def main(args):
     logging.basicConfig(format="%(asctime)s %(message)s", level=logging.INFO)
 
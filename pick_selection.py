@@ -0,0 +1,90 @@
+###############################################################################
+# Description:
+# Vectorized selection of PhaseNet picks for 5_3c_filter.py: the best P and
+# S pick of every station-event (file_name), the P-before-S check and the
+# expansion to the three component SAC files, as whole-column operations
+# instead of per-group Python calls. PhaseNet writes fixed-width millisecond
+# ISO times (2014-01-01T00:00:03.450), which sort lexically, so the times are
+# ordered and compared as strings and never parsed.
+###############################################################################
+import numpy as np
+import pandas as pd
+
+###############################################################################
+MIN_SCORE = 0.3
+PHASES = ["P", "S"]
+COMPONENTS = ["BHE", "BHN", "BHZ"]
+COLUMNS = ["station_id", "begin_time", "phase_index", "phase_time", "phase_score", "phase_type", "file_name"]
+
+
+def _file_codes(file_name):
+    # Integer codes of the file names, ranked in file_name order
+    codes, files = pd.factorize(file_name)
+    rank = np.empty(len(files), dtype=np.int64)
+    rank[files.argsort()] = np.arange(len(files))
+    return rank[codes]
+
+
+def _earlier(times, rows_a, rows_b):
+    # times[rows_a] < times[rows_b], compared as strings
+    return np.asarray(times.array.take(rows_a) < times.array.take(rows_b), dtype=bool)
+
+
+def sort_picks(df, rows, file_codes, is_s):
+    # Positions `rows` of df ordered by begin_time, then file_name and
+    # phase_time (P first at equal times), with at most one P and one S pick
+    # per file; file_codes rank the file names. Rows are sorted on integer
+    # codes by begin_time, file and phase, then the P/S pairs whose S pick is
+    # earlier are swapped
+    begin_codes, _ = pd.factorize(df["begin_time"].array.take(rows), sort=True)
+    order = np.lexsort((is_s, file_codes, begin_codes))
+    rows, file_codes = rows[order], file_codes[order]
+
+    first = np.flatnonzero(file_codes[1:] == file_codes[:-1])
+    swap = first[_earlier(df["phase_time"], rows[first + 1], rows[first])]
+    rows[swap], rows[swap + 1] = rows[swap + 1], rows[swap]
+    return rows
+
+
+def select_best_picks(df, min_score=MIN_SCORE):
+    # Highest-score P and S pick of every file whose best pick of any phase
+    # scores above min_score; ties keep the first pick in file order.
+    # Files are handled by their integer codes, in file_name order, and the
+    # frame is indexed only once, by the positions of the selected picks
+    rows = np.flatnonzero(df["phase_type"].isin(PHASES).to_numpy())
+    codes = _file_codes(df["file_name"])[rows]
+    is_s = (df["phase_type"] == "S").to_numpy()[rows].astype(np.int64)
+    score = df["phase_score"].to_numpy()[rows]
+
+    best = pd.Series(score).groupby(codes * 2 + is_s, sort=False).idxmax().to_numpy()
+    file_max = pd.Series(score[best]).groupby(codes[best], sort=False).transform("max").to_numpy()
+    best = best[file_max > min_score]
+
+    rows = sort_picks(df, rows[best], codes[best], is_s[best])
+    return df.iloc[rows][COLUMNS].reset_index(drop=True)
+
+
+def select_ps_pairs(df):
+    # Picks of the files with both a P and an S pick, P before S. The P and
+    # S pick positions are scattered by the integer file codes, which also
+    # map the result back to the picks
+    codes, files = pd.factorize(df["file_name"])
+    is_p = (df["phase_type"] == "P").to_numpy()
+    is_s = (df["phase_type"] == "S").to_numpy()
+
+    p_rows = np.full(len(files), -1)
+    s_rows = np.full(len(files), -1)
+    p_rows[codes[is_p]] = np.flatnonzero(is_p)
+    s_rows[codes[is_s]] = np.flatnonzero(is_s)
+    both = np.flatnonzero((p_rows >= 0) & (s_rows >= 0))
+    paired = np.zeros(len(files), dtype=bool)
+    paired[both] = _earlier(df["phase_time"], p_rows[both], s_rows[both])
+    return df[paired[codes]].reset_index(drop=True)
+
+
+def expand_to_components(df):
+    # One row per component SAC file: "NET.STA.<time>.BH*" -> .BHE/.BHN/.BHZ.SAC
+    components = pd.DataFrame({"component": COMPONENTS})
+    expanded = df.merge(components, how="cross")
+    expanded["file_name"] = expanded["file_name"].str[:-3] + expanded["component"] + ".SAC"
+    return expanded[COLUMNS]
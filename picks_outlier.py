@@ -0,0 +1,333 @@
+###############################################################################
+# Description:
+# Travel-time outlier analysis of the P (t1) and S (t2) picks of
+# 8_3c_picks_outlier.ipynb from the SAC headers alone: o, t1, t2 and dist of
+# all files are decoded from the 632-byte headers (sac_io.read_sac_headers),
+# read in parallel, and the waveform samples are never loaded.
+# The t - o vs distance lines are fitted for all groups at once (one global
+# line, or one per event, station, ...) from per-group sums, with
+#   std_dev: least squares, outliers beyond threshold x the residual std
+#   huber:   Huber M-estimate (iteratively reweighted least squares),
+#            outliers beyond threshold x the robust (MAD) residual scale
+#   ransac:  random two-pick lines, the one with the most inliers refitted
+#            by least squares on its inliers (inliers within threshold x
+#            the robust residual scale of a Huber line, or a residual in s)
+# A group gets its own line only with enough distinct distances; the three
+# component files of an event-station share one distance and count once.
+# A pick table row is an outlier if its P or its S pick is one.
+# The returned lines are least-squares refits on the rows normal in both.
+# Usage: python picks_outlier.py [directory] [--method huber] [--by Event]
+###############################################################################
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sac_io import FNULL, read_sac_headers
+
+###############################################################################
+PHASES = ["t1", "t2"]  # P and S picks
+COLUMNS = ["Filename", "Distance", "t1_minus_O", "t2_minus_O"]
+METHODS = ["std_dev", "huber", "ransac"]
+THRESHOLD = 3.0  # residual scales
+HUBER_EPSILON = 1.35
+MAX_ITER = 50
+RANSAC_TRIALS = 200
+MIN_GROUP_SIZE = 5  # distinct distances; smaller groups use the global line
+READ_CHUNK = 1000  # files per header read task
+MAD_SCALE = 1.4826  # MAD -> standard deviation of a normal distribution
+
+
+def sac_files(directory):
+    # SAC files of a directory, sorted
+    with os.scandir(directory) as entries:
+        return sorted(entry.path for entry in entries if entry.is_file() and entry.name.endswith(".SAC"))
+
+
+def pick_table(directories, workers=4):
+    # One row per SAC file with o, t1, t2 and dist set and both picks after
+    # o: file name, distance, t1 - o and t2 - o, plus the Event
+    # ("2014-01-01T00:00") and Station ("YB.S04") of the file name for
+    # grouping. Headers are read in chunks on a thread pool
+    if isinstance(directories, str):
+        directories = [directories]
+    paths = [path for directory in directories for path in sac_files(directory)]
+    chunks = [paths[i : i + READ_CHUNK] for i in range(0, len(paths), READ_CHUNK)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(read_sac_headers, chunks))
+    if not results:
+        return pd.DataFrame(columns=COLUMNS + ["Event", "Station"])
+    headers = np.concatenate([headers for headers, _ in results])
+    valid = np.concatenate([valid for _, valid in results])
+    for name in ("o", "t1", "t2", "dist"):
+        valid &= headers[name] != FNULL
+    # float32 differences, as from the ObsPy headers
+    t1 = headers["t1"] - headers["o"]
+    t2 = headers["t2"] - headers["o"]
+    valid &= (t1 > 0) & (t2 > 0)
+
+    names = pd.Series([os.path.basename(path) for path in paths], dtype=object)[valid]
+    parts = names.str.split(".")
+    return pd.DataFrame(
+        {
+            "Filename": names.to_numpy(),
+            "Distance": headers["dist"][valid].astype(np.float64),
+            "t1_minus_O": t1[valid].astype(np.float64),
+            "t2_minus_O": t2[valid].astype(np.float64),
+            "Event": parts.str[2].to_numpy(),
+            "Station": (parts.str[0] + "." + parts.str[1]).to_numpy(),
+        }
+    )
+
+
+###############################################################################
+# Line fits of all groups at once: x, y and the group code of every point
+def _line_fit(x, y, groups, n_groups, weights=None):
+    # Weighted least-squares slope and intercept of every group (NaN for
+    # groups with fewer than two distinct distances)
+    w = np.ones_like(x) if weights is None else weights
+    sw = np.bincount(groups, w, n_groups)
+    sx = np.bincount(groups, w * x, n_groups)
+    sy = np.bincount(groups, w * y, n_groups)
+    sxx = np.bincount(groups, w * x * x, n_groups)
+    sxy = np.bincount(groups, w * x * y, n_groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        denom = sw * sxx - sx * sx
+        slope = np.where(np.abs(denom) > 1e-12 * np.maximum(sw * sxx, 1e-300), (sw * sxy - sx * sy) / denom, np.nan)
+        intercept = (sy - slope * sx) / sw
+    return slope, intercept
+
+
+def _group_median(values, groups, n_groups):
+    # Median of values within every group (NaN for empty groups)
+    if len(values) == 0:
+        return np.full(n_groups, np.nan)
+    order = np.lexsort((values, groups))
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    values = values[order]
+    lower = values[np.minimum(starts + (counts - 1) // 2, len(values) - 1)]
+    upper = values[np.minimum(starts + counts // 2, len(values) - 1)]
+    return np.where(counts > 0, 0.5 * (lower + upper), np.nan)
+
+
+def _residual_scale(residuals, groups, n_groups):
+    # Robust standard deviation (scaled MAD) of the residuals of every group
+    return MAD_SCALE * _group_median(np.abs(residuals), groups, n_groups)
+
+
+def _distinct_distances(x, groups, n_groups, mask=None):
+    # Number of distinct distances (event-stations) of every group
+    if mask is not None:
+        x, groups = x[mask], groups[mask]
+    order = np.lexsort((x, groups))
+    x, groups = x[order], groups[order]
+    new = np.ones(len(x), dtype=bool)
+    new[1:] = (groups[1:] != groups[:-1]) | (x[1:] != x[:-1])
+    return np.bincount(groups[new], minlength=n_groups)
+
+
+def min_distances(method, min_group_size=MIN_GROUP_SIZE, threshold=THRESHOLD, **kwargs):
+    # Distinct distances a group needs for its own line. A residual of n
+    # points is at most sqrt(n - 1) standard deviations, so the std_dev
+    # cut cannot flag anything in groups of threshold**2 + 1 or fewer
+    if method == "std_dev":
+        return max(min_group_size, int(np.floor(threshold**2)) + 2)
+    return min_group_size
+
+
+def fit_std_dev(x, y, groups, n_groups, threshold=THRESHOLD):
+    # Least-squares lines; points within threshold x the residual standard
+    # deviation are inliers, and the lines are refitted on them
+    slope, intercept = _line_fit(x, y, groups, n_groups)
+    residuals = y - (slope[groups] * x + intercept[groups])
+    std = np.sqrt(np.bincount(groups, residuals**2, n_groups) / np.bincount(groups, minlength=n_groups))
+    inliers = np.abs(residuals) <= threshold * std[groups]
+    slope, intercept = _line_fit(x, y, groups, n_groups, inliers.astype(np.float64))
+    return slope, intercept, inliers
+
+
+def fit_huber(x, y, groups, n_groups, threshold=THRESHOLD, epsilon=HUBER_EPSILON, max_iter=MAX_ITER, tol=1e-8):
+    # Huber M-estimate by iteratively reweighted least squares: residuals
+    # beyond epsilon x the robust scale are down-weighted (w = epsilon s / |r|).
+    # Points within threshold x the final robust scale are inliers
+    slope, intercept = _line_fit(x, y, groups, n_groups)
+    for _ in range(max_iter):
+        residuals = y - (slope[groups] * x + intercept[groups])
+        scale = np.maximum(_residual_scale(residuals, groups, n_groups), 1e-6)
+        abs_residuals = np.abs(residuals)
+        with np.errstate(divide="ignore"):
+            weights = np.minimum(1.0, epsilon * scale[groups] / abs_residuals)
+        new_slope, new_intercept = _line_fit(x, y, groups, n_groups, weights)
+        change = np.nanmax(np.abs(np.concatenate([new_slope - slope, new_intercept - intercept])), initial=0.0)
+        slope, intercept = new_slope, new_intercept
+        if change < tol:
+            break
+    residuals = y - (slope[groups] * x + intercept[groups])
+    scale = _residual_scale(residuals, groups, n_groups)
+    inliers = np.abs(residuals) <= threshold * scale[groups]
+    return slope, intercept, inliers
+
+
+def fit_ransac(
+    x, y, groups, n_groups, residual_threshold=None, threshold=THRESHOLD, n_trials=RANSAC_TRIALS, seed=0,
+    chunk_size=20000,
+):
+    # RANSAC: n_trials lines through two random points of every group; the
+    # line with the most points within residual_threshold (s; by default
+    # threshold x the robust residual scale of the Huber line of the group)
+    # is refitted by least squares on its inliers
+    rng = np.random.default_rng(seed)
+    order = np.argsort(groups, kind="stable")
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    first = np.floor(rng.random((n_groups, n_trials)) * counts[:, None]).astype(np.int64)
+    step = 1 + np.floor(rng.random((n_groups, n_trials)) * np.maximum(counts - 1, 1)[:, None]).astype(np.int64)
+    second = (first + step) % np.maximum(counts, 1)[:, None]
+    i = order[np.minimum(starts[:, None] + first, len(x) - 1)]
+    j = order[np.minimum(starts[:, None] + second, len(x) - 1)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        trial_slope = (y[j] - y[i]) / (x[j] - x[i])
+    usable = np.isfinite(trial_slope) & (counts >= 2)[:, None]
+    trial_slope = np.where(usable, trial_slope, 0.0)
+    trial_intercept = y[i] - trial_slope * x[i]
+
+    if residual_threshold is None:
+        slope, intercept, _ = fit_huber(x, y, groups, n_groups)
+        scale = _residual_scale(y - (slope[groups] * x + intercept[groups]), groups, n_groups)
+        threshold = threshold * np.maximum(np.nan_to_num(scale), 1e-6)
+    else:
+        threshold = np.full(n_groups, float(residual_threshold))
+
+    # Inlier counts (and residual sums, for ties) of every trial line
+    n_inliers = np.zeros((n_groups, n_trials))
+    sq_sum = np.zeros((n_groups, n_trials))
+    trials = np.arange(n_trials)
+    for start in range(0, len(x), chunk_size):
+        rows = slice(start, start + chunk_size)
+        g = groups[rows]
+        residuals = np.abs(y[rows, None] - (trial_slope[g] * x[rows, None] + trial_intercept[g]))
+        inside = residuals <= threshold[g, None]
+        cells = (g[:, None] * n_trials + trials).ravel()
+        n_inliers += np.bincount(cells, inside.ravel(), n_groups * n_trials).reshape(n_groups, n_trials)
+        sq_sum += np.bincount(cells, np.where(inside, residuals**2, 0).ravel(), n_groups * n_trials).reshape(
+            n_groups, n_trials
+        )
+    n_inliers[~usable] = -1
+    best = np.lexsort((sq_sum, -n_inliers), axis=-1)[:, 0] if n_trials else np.zeros(n_groups, dtype=np.int64)
+
+    rows = np.arange(n_groups)
+    slope = trial_slope[rows, best][groups]
+    intercept = trial_intercept[rows, best][groups]
+    inliers = np.abs(y - (slope * x + intercept)) <= threshold[groups]
+    inliers &= usable[rows, best][groups]
+    slope, intercept = _line_fit(x, y, groups, n_groups, inliers.astype(np.float64))
+    return slope, intercept, inliers
+
+
+FITS = {"std_dev": fit_std_dev, "huber": fit_huber, "ransac": fit_ransac}
+
+
+###############################################################################
+def fit_lines(x, y, groups=None, method="huber", min_group_size=MIN_GROUP_SIZE, **kwargs):
+    # Slope, intercept (per group) and inlier mask of the travel times y vs
+    # distances x with method; groups: integer code of every point. Groups
+    # with too few distinct distances (min_distances), or without a usable
+    # line, are judged against the line of all points
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if method not in FITS:
+        raise ValueError(f"Invalid method {method!r}, expected one of {METHODS}")
+    fit = FITS[method]
+    if len(x) == 0:
+        n_groups = 1 if groups is None else int(np.max(groups, initial=-1)) + 1
+        return np.full(n_groups, np.nan), np.full(n_groups, np.nan), np.zeros(0, dtype=bool)
+    single = np.zeros(len(x), dtype=np.int64)
+    slope_all, intercept_all, inliers_all = fit(x, y, single, 1, **kwargs)
+    if groups is None:
+        return slope_all, intercept_all, inliers_all
+
+    groups = np.asarray(groups, dtype=np.int64)
+    n_groups = int(groups.max()) + 1 if len(groups) else 0
+    slope, intercept, inliers = fit(x, y, groups, n_groups, **kwargs)
+    small = _distinct_distances(x, groups, n_groups) < min_distances(method, min_group_size, **kwargs)
+    fallback = small | np.isnan(slope) | np.isnan(intercept)
+    slope[fallback], intercept[fallback] = slope_all[0], intercept_all[0]
+    inliers = np.where(fallback[groups], inliers_all, inliers)
+    return slope, intercept, inliers
+
+
+def refit_lines(x, y, groups, inliers, min_group_size=MIN_GROUP_SIZE):
+    # Least-squares lines of the inliers of every group; groups with fewer
+    # than min_group_size distinct inlier distances, or without a usable
+    # line, use the line of all inliers
+    weights = inliers.astype(np.float64)
+    slope_all, intercept_all = _line_fit(x, y, np.zeros(len(x), dtype=np.int64), 1, weights)
+    if groups is None:
+        return slope_all, intercept_all
+    n_groups = int(groups.max()) + 1
+    slope, intercept = _line_fit(x, y, groups, n_groups, weights)
+    small = _distinct_distances(x, groups, n_groups, inliers) < min_group_size
+    fallback = small | np.isnan(slope) | np.isnan(intercept)
+    slope[fallback], intercept[fallback] = slope_all[0], intercept_all[0]
+    return slope, intercept
+
+
+def classify_picks(df, method="huber", by=None, min_group_size=MIN_GROUP_SIZE, **kwargs):
+    # Split a pick_table into normal and outlier rows (sorted by file name),
+    # fitting the t1 and t2 lines per group of the by column(s) (one line
+    # for all rows with by=None). A row is normal if both its picks are
+    # inliers; the returned lines are then refitted by least squares on the
+    # normal rows, as in the notebook, and the residuals from them are added
+    # as t1_residual / t2_residual
+    if df.empty:
+        return df, df, pd.DataFrame()
+    if by is None:
+        codes, keys = np.zeros(len(df), dtype=np.int64), pd.Index(["all"], name="group")
+        groups = None
+    else:
+        by = [by] if isinstance(by, str) else list(by)
+        codes, keys = pd.MultiIndex.from_frame(df[by]).factorize(sort=True)
+        groups = codes
+    df = df.copy()
+    normal = np.ones(len(df), dtype=bool)
+    fits = pd.DataFrame(index=keys)
+    x = df["Distance"].to_numpy(dtype=np.float64)
+    for phase in PHASES:
+        y = df[f"{phase}_minus_O"].to_numpy(dtype=np.float64)
+        normal &= fit_lines(x, y, groups, method, min_group_size, **kwargs)[2]
+    for phase in PHASES:
+        y = df[f"{phase}_minus_O"].to_numpy(dtype=np.float64)
+        slope, intercept = refit_lines(x, y, groups, normal, min_distances(method, min_group_size, **kwargs))
+        df[f"{phase}_residual"] = y - (slope[codes] * x + intercept[codes])
+        fits[f"{phase}_slope"], fits[f"{phase}_intercept"] = slope, intercept
+    normal_df = df[normal].sort_values("Filename").reset_index(drop=True)
+    outlier_df = df[~normal].sort_values("Filename").reset_index(drop=True)
+    return normal_df, outlier_df, fits
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", nargs="?", default="./CAP_7SNR_3SAC", help="SAC files with o, t1, t2 and dist")
+    parser.add_argument("--method", default="huber", choices=METHODS, help="line fit")
+    parser.add_argument("--by", nargs="*", default=None, help="group columns, e.g. Event or Station")
+    parser.add_argument("--threshold", default=THRESHOLD, type=float, help="inlier residual scales")
+    parser.add_argument(
+        "--residual_threshold", default=None, type=float, help="ransac inlier residual, s (instead of --threshold)"
+    )
+    parser.add_argument("--workers", default=4, type=int, help="header read threads")
+    args = parser.parse_args()
+
+    kwargs = {"threshold": args.threshold}
+    if args.method == "ransac":
+        kwargs["residual_threshold"] = args.residual_threshold
+    table = pick_table(args.directory, workers=args.workers)
+    normal_df, outlier_df, fits = classify_picks(table, args.method, by=args.by or None, **kwargs)
+    csv_file_path = os.path.join(args.directory, "sac_data_filtered.csv")
+    outlier_file_path = os.path.join(args.directory, "sac_data_outliers.csv")
+    normal_df.to_csv(csv_file_path, index=False)
+    outlier_df.to_csv(outlier_file_path, index=False)
+    print(fits.to_string())
+    print(f"Saved {len(normal_df)} normal picks to: {csv_file_path}")
+    print(f"Saved {len(outlier_df)} outlier picks to: {outlier_file_path}")
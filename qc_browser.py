@@ -0,0 +1,391 @@
+###############################################################################
+# Description:
+# Local web browser for the visual QC of the three-component SAC files
+# (9_3c_visual_QC.ipynb). One thumbnail per station-event shows the E, N and
+# Z traces around the origin with the o, P (t1) and S (t2) marks. The
+# thumbnails of the next groups are rendered ahead of time by a process pool
+# and cached on disk, so the review never waits for reading or plotting.
+# Decisions are appended to a log (one line per key press; the last line of
+# a group wins), and accepted groups are copied to the target directory in
+# the background.
+# Keys: a / s accept, d / r reject, left / right (or k / j) move, u back to
+# the first undecided group.
+# Usage: python qc_browser.py [--source_dir ./CAP_8QC_3SAC]
+#        [--target_dir ./CAP_9Final_3SAC] [--port 8000] [--ahead 20]
+###############################################################################
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+import numpy as np
+from sac_io import FNULL, clone_file, header_strings, read_sac_bulk, read_sac_headers
+
+###############################################################################
+COMPONENTS = ["BHE", "BHN", "BHZ"]
+COLORS = ["#66c2a5", "#fc8d62", "#8da0cb"]  # seaborn Set2, as in the notebook plots
+DECISIONS = {"accept", "reject"}
+TIME_BEFORE = 10.0  # s before o
+TIME_AFTER = 90.0  # s after o
+AHEAD = 20  # groups rendered ahead of the current one
+DPI = 80
+
+
+def group_bases(source_dir):
+    # Station-event bases ("YB.S04.2014-01-01T00:00") with all three
+    # component files, sorted
+    with os.scandir(source_dir) as entries:
+        names = {entry.name for entry in entries if entry.is_file() and entry.name.endswith(".SAC")}
+    bases = {".".join(name.split(".")[:-2]) for name in names}
+    return sorted(base for base in bases if all(f"{base}.{comp}.SAC" in names for comp in COMPONENTS))
+
+
+def group_files(base, source_dir):
+    return [os.path.join(source_dir, f"{base}.{comp}.SAC") for comp in COMPONENTS]
+
+
+def render_group(base, source_dir, cache_dir, before=TIME_BEFORE, after=TIME_AFTER):
+    # Thumbnail (PNG) of one station-event in cache_dir: the three
+    # components in one figure from o - before to o + after, with the
+    # origin, P and S marks. Kept while newer than the SAC files
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    paths = group_files(base, source_dir)
+    image = os.path.join(cache_dir, f"{base}_{before:g}_{after:g}.png")
+    if os.path.exists(image) and os.path.getmtime(image) >= max(os.path.getmtime(path) for path in paths):
+        return image
+
+    headers, data, ok = read_sac_bulk(paths, mmap=False)
+    fig, axes = plt.subplots(len(paths), 1, sharex=True, figsize=(8, 6))
+    for ax, path, header, x, good, color in zip(axes, paths, headers, data, ok, COLORS):
+        if not good:
+            ax.set_title(f"{os.path.basename(path)}: unreadable", fontsize=9)
+            continue
+        o = float(header["o"]) if header["o"] != FNULL else 0.0
+        times = float(header["b"]) + float(header["delta"]) * np.arange(len(x)) - o
+        keep = (times >= -before) & (times <= after)
+        ax.plot(times[keep], x[keep], color=color, lw=0.6)
+        ax.axvline(0.0, color="black", linestyle="-", lw=2, label="Origin time")
+        for name, mark_color, label in (("t1", "r", "P-wave"), ("t2", "b", "S-wave")):
+            if header[name] != FNULL:
+                ax.axvline(float(header[name]) - o, color=mark_color, linestyle="--", lw=1.5, label=label)
+        ax.text(0.01, 0.9, os.path.basename(path), transform=ax.transAxes, fontsize=8, va="top")
+    axes[0].legend(fontsize=7, loc="upper right")
+    axes[-1].set_xlim(-before, after)
+    axes[-1].set_xlabel("Time after origin (s)")
+    fig.tight_layout()
+
+    # Written under a temporary name so that a reader never sees half a file
+    tmp_image = f"{image}.{os.getpid()}.tmp"
+    fig.savefig(tmp_image, dpi=DPI, format="png")
+    plt.close(fig)
+    os.replace(tmp_image, image)
+    return image
+
+
+class ThumbnailCache:
+    """Thumbnails rendered ahead of the review position by a process pool
+    (spawn, as the figure writer of phasenet/predict.py)."""
+
+    def __init__(self, source_dir, cache_dir, bases, processes=2, ahead=AHEAD, before=TIME_BEFORE, after=TIME_AFTER):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.source_dir = source_dir
+        self.cache_dir = cache_dir
+        self.bases = bases
+        self.ahead = ahead
+        self.window = (before, after)
+        self.pool = multiprocessing.get_context("spawn").Pool(processes)
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def prefetch(self, index):
+        # Queue the groups index ... index + ahead that are not queued yet
+        with self.lock:
+            for base in self.bases[index:index + self.ahead]:
+                if base not in self.jobs:
+                    self.jobs[base] = self.pool.apply_async(
+                        render_group, (base, self.source_dir, self.cache_dir) + self.window
+                    )
+
+    def image(self, index):
+        # PNG bytes of group index, waiting for its render if needed
+        self.prefetch(index)
+        base = self.bases[index]
+        try:
+            path = self.jobs[base].get()
+        except Exception as e:
+            print(f"[ERROR] Rendering failed: {base}: {e}")
+            with self.lock:
+                self.jobs.pop(base, None)
+            raise
+        with open(path, "rb") as f:
+            return f.read()
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+class DecisionLog:
+    """Append-only CSV of the accept / reject decisions (time, base,
+    decision); replaying it gives the latest decision of every group."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        decisions = {}
+        if os.path.exists(self.path):
+            with open(self.path, newline="") as f:
+                for row in csv.reader(f):
+                    if len(row) == 3 and row[2] in DECISIONS:
+                        decisions[row[1]] = row[2]
+        return decisions
+
+    def record(self, base, decision):
+        with self.lock, open(self.path, "a", newline="") as f:
+            csv.writer(f).writerow([time.strftime("%Y-%m-%dT%H:%M:%S"), base, decision])
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class QCBrowser:
+    """Review state (groups, decisions, file copies) behind the web page."""
+
+    def __init__(self, source_dir="./CAP_8QC_3SAC", target_dir="./CAP_9Final_3SAC", cache_dir="./qc_cache",
+                 log_file=None, processes=2, ahead=AHEAD, before=TIME_BEFORE, after=TIME_AFTER):
+        os.makedirs(target_dir, exist_ok=True)
+        self.source_dir = source_dir
+        self.target_dir = target_dir
+        self.bases = group_bases(source_dir)
+        self.positions = {base: index for index, base in enumerate(self.bases)}
+        self.log = DecisionLog(log_file or os.path.join(target_dir, "qc_decisions.csv"))
+        self.decisions = self.log.load()
+        self.cache = ThumbnailCache(source_dir, cache_dir, self.bases, processes, ahead, before, after)
+        # File copies off the request threads, in decision order
+        self.copier = ThreadPoolExecutor(max_workers=1)
+        self.info = self._group_info()
+        self.server = None
+
+    def _group_info(self):
+        # Station, distance and picks of every group from the Z headers, and
+        # the newest file time as the thumbnail version
+        files = [group_files(base, self.source_dir) for base in self.bases]
+        headers, valid = read_sac_headers([paths[-1] for paths in files])
+        stations = header_strings(headers, "kstnm")
+        info = []
+        for paths, station, header, good in zip(files, stations, headers, valid):
+            values = {name: round(float(header[name]), 3) if good and header[name] != FNULL else None
+                      for name in ("dist", "o", "t1", "t2")}
+            version = max(os.stat(path).st_mtime_ns for path in paths)
+            info.append({"station": station, **values, "version": version})
+        return info
+
+    def first_undecided(self):
+        return next((i for i, base in enumerate(self.bases) if base not in self.decisions), len(self.bases))
+
+    def state(self):
+        return {
+            "bases": self.bases,
+            "info": self.info,
+            "decisions": [self.decisions.get(base) for base in self.bases],
+            "index": self.first_undecided(),
+        }
+
+    def decide(self, index, decision):
+        # Record the decision and update the target directory to match it
+        base = self.bases[index]
+        self.log.record(base, decision)
+        self.decisions[base] = decision
+        self.copier.submit(self._apply, base, decision)
+
+    def _apply(self, base, decision):
+        try:
+            for path in group_files(base, self.source_dir):
+                target = os.path.join(self.target_dir, os.path.basename(path))
+                if decision == "accept":
+                    clone_file(path, target)
+                elif os.path.exists(target):
+                    os.remove(target)
+        except OSError as e:
+            print(f"[ERROR] QC file update failed: {base}: {e}")
+
+    def summary(self):
+        accepted = sum(decision == "accept" for decision in self.decisions.values())
+        rejected = sum(decision == "reject" for decision in self.decisions.values())
+        return {"groups": len(self.bases), "accepted": accepted, "rejected": rejected,
+                "undecided": len(self.bases) - accepted - rejected}
+
+    def start(self, host="127.0.0.1", port=8000):
+        # Serve in a background thread (e.g. from a notebook); returns the URL
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.cache.prefetch(self.first_undecided())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self.server.server_port}/"
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.copier.shutdown(wait=True)
+        self.cache.close()
+
+
+###############################################################################
+# Web page and request handler
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>SAC visual QC</title>
+<style>
+body { font-family: sans-serif; margin: 1em; background: whitesmoke; }
+#img { width: 800px; height: 600px; background: white; display: block; }
+.accept { color: green; } .reject { color: red; } #status { color: red; min-height: 1.2em; }
+</style></head>
+<body>
+<div id="title"></div><div id="info"></div><div id="status"></div>
+<img id="img" alt="">
+<p>a / s accept &middot; d / r reject &middot; &larr; / &rarr; (k / j) move &middot; u first undecided</p>
+<script>
+let state = null, index = 0;
+const AHEAD = %(ahead)d;
+const cache = {};
+// Thumbnails are addressed by group name and file version, so a cached
+// image always belongs to the group shown, also after the groups change
+function url(i) { return "/image/" + encodeURIComponent(state.bases[i]) + ".png?v=" + state.info[i].version; }
+function preload(i) {
+  for (let k = i; k < Math.min(i + AHEAD, state.bases.length); k++) {
+    if (!cache[k]) { cache[k] = new Image(); cache[k].src = url(k); }
+  }
+}
+function show() {
+  if (index >= state.bases.length) {
+    document.getElementById("title").textContent = "All " + state.bases.length + " groups reviewed";
+    return;
+  }
+  const d = state.decisions[index], info = state.info[index];
+  document.getElementById("title").innerHTML = "<b>" + (index + 1) + " / " + state.bases.length + "</b> "
+    + state.bases[index] + (d ? " <span class='" + d + "'>" + d + "</span>" : "");
+  document.getElementById("info").textContent = "Station: " + info.station + "  Distance: " + info.dist
+    + "  P-pick: " + info.t1 + "  S-pick: " + info.t2;
+  document.getElementById("img").src = url(index);
+  preload(index + 1);
+}
+function status(text) { document.getElementById("status").textContent = text; }
+// A group is marked, and the view moves on, only once the server has
+// recorded the decision; otherwise it stays undecided and the error is shown
+function decide(decision) {
+  if (index >= state.bases.length) return;
+  const i = index;
+  fetch("/decision", {method: "POST", body: JSON.stringify({index: i, decision: decision})})
+    .then(r => { if (!r.ok) throw new Error("server answered " + r.status + " " + r.statusText); })
+    .then(() => {
+      state.decisions[i] = decision;
+      status("");
+      if (index === i) index++;
+      show();
+    })
+    .catch(e => status("Decision not saved for " + state.bases[i] + ": " + e.message));
+}
+document.addEventListener("keydown", e => {
+  const k = e.key;
+  if (k === "a" || k === "s") decide("accept");
+  else if (k === "d" || k === "r") decide("reject");
+  else if (k === "ArrowRight" || k === "j") { index = Math.min(index + 1, state.bases.length); show(); }
+  else if (k === "ArrowLeft" || k === "k") { index = Math.max(index - 1, 0); show(); }
+  else if (k === "u") { index = state.decisions.findIndex(d => !d); if (index < 0) index = state.bases.length; show(); }
+});
+fetch("/state").then(r => r.json()).then(s => { state = s; index = s.index; show(); });
+</script></body></html>
+"""
+
+
+def _handler(browser):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, body, content_type, status=200, cache=False):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "max-age=3600" if cache else "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/":
+                self._send((PAGE % {"ahead": browser.cache.ahead}).encode(), "text/html; charset=utf-8")
+            elif path == "/state":
+                self._send(json.dumps(browser.state()).encode(), "application/json")
+            elif path.startswith("/image/") and path.endswith(".png"):
+                index = browser.positions.get(unquote(path[len("/image/"):-len(".png")]))
+                if index is None:
+                    self._send(b"not found", "text/plain", 404)
+                    return
+                try:
+                    body = browser.cache.image(index)
+                except Exception:
+                    self._send(b"render failed", "text/plain", 500)
+                    return
+                self._send(body, "image/png", cache=True)
+            else:
+                self._send(b"not found", "text/plain", 404)
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/decision":
+                self._send(b"not found", "text/plain", 404)
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                index, decision = int(request["index"]), request["decision"]
+                if decision not in DECISIONS or not 0 <= index < len(browser.bases):
+                    raise ValueError(decision)
+            except (ValueError, KeyError, TypeError):
+                self._send(b"bad request", "text/plain", 400)
+                return
+            try:
+                browser.decide(index, decision)
+            except OSError as e:
+                print(f"[ERROR] QC decision not recorded: {browser.bases[index]}: {e}")
+                self._send(b"decision not recorded", "text/plain", 500)
+                return
+            self._send(b"{}", "application/json")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source_dir", default="./CAP_8QC_3SAC", help="SAC files to review")
+    parser.add_argument("--target_dir", default="./CAP_9Final_3SAC", help="accepted SAC files")
+    parser.add_argument("--cache_dir", default="./qc_cache", help="rendered thumbnails")
+    parser.add_argument("--log_file", default=None, help="decision log (default: target_dir/qc_decisions.csv)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", default=8000, type=int)
+    parser.add_argument("--processes", default=2, type=int, help="render processes")
+    parser.add_argument("--ahead", default=AHEAD, type=int, help="groups rendered ahead")
+    parser.add_argument("--before", default=TIME_BEFORE, type=float, help="s before o")
+    parser.add_argument("--after", default=TIME_AFTER, type=float, help="s after o")
+    args = parser.parse_args()
+
+    browser = QCBrowser(args.source_dir, args.target_dir, args.cache_dir, args.log_file, args.processes,
+                        args.ahead, args.before, args.after)
+    print(f"Reviewing {len(browser.bases)} station-events at {browser.start(args.host, args.port)} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        browser.close()
+        print(browser.summary())
@@ -0,0 +1,108 @@
+###############################################################################
+# Description:
+# Quality control of raw waveform counts before response removal.
+# Dead (flat), clipped, spiky and saturated channels are rejected in
+# 2_remove_response.py before the detrend/taper/deconvolution/write path,
+# instead of being thrown away later in the SNR and outlier notebooks.
+# All metrics are computed on whole (n_traces, npts) stacks at once.
+###############################################################################
+import numpy as np
+
+###############################################################################
+QC_THRESHOLDS = {
+    # Fraction of samples at the minimum or maximum value of the trace,
+    # beyond the single minimum and maximum every trace has
+    "max_clip_fraction": 0.001,
+    # Largest single-sample glitch (sample minus 3-point median) relative to
+    # the amplitude of the 3-point median filtered trace
+    "max_spike_ratio": 10.0,
+    # Longest run of consecutive samples stuck at the minimum or maximum
+    "max_saturation_run": 10,
+}
+
+
+def _as_stack(data):
+    data = np.asarray(data, dtype=np.float64)
+    return data[np.newaxis, :] if data.ndim == 1 else data
+
+
+def median3(data):
+    # 3-point running median along the last axis, end samples kept
+    a, b, c = data[:, :-2], data[:, 1:-1], data[:, 2:]
+    med = data.copy()
+    med[:, 1:-1] = np.maximum(np.minimum(a, b), np.minimum(np.maximum(a, b), c))
+    return med
+
+
+def longest_rail_run(data, top, bottom):
+    # Longest run of equal consecutive samples at the top or bottom value of
+    # each row, from the run boundaries of all rows at once
+    n, npts = data.shape
+    at_rail = (data == top[:, np.newaxis]) | (data == bottom[:, np.newaxis])
+    # A run starts where the value changes or a row starts
+    starts = np.ones((n, npts), dtype=bool)
+    starts[:, 1:] = data[:, 1:] != data[:, :-1]
+    row, col = np.nonzero(starts)
+    lengths = np.diff(np.append(row * npts + col, n * npts))
+    rail_runs = np.where(at_rail[row, col], lengths, 0)
+    longest = np.zeros(n, dtype=np.int64)
+    np.maximum.at(longest, row, rail_runs)
+    return longest
+
+
+def qc_metrics(data):
+    # QC metrics of one trace (1-D) or a stack of equal-length traces (2-D)
+    data = _as_stack(data)
+    finite = np.isfinite(data).all(axis=1)
+    top = data.max(axis=1)
+    bottom = data.min(axis=1)
+    at_rail = (data == top[:, np.newaxis]) | (data == bottom[:, np.newaxis])
+
+    med = median3(data)
+    center = np.median(med, axis=1, keepdims=True)
+    amplitude = np.abs(med - center).max(axis=1)
+    glitch = np.abs(data - med).max(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        spike_ratio = np.where(amplitude > 0, glitch / amplitude, np.where(glitch > 0, np.inf, 0.0))
+
+    return {
+        "finite": finite,
+        "variance": data.var(axis=1),
+        "clip_fraction": np.maximum(at_rail.sum(axis=1) - 2, 0) / data.shape[1],
+        "spike_ratio": spike_ratio,
+        "saturation_run": longest_rail_run(data, top, bottom),
+    }
+
+
+def qc_reasons(data, thresholds=QC_THRESHOLDS):
+    # Rejection reasons per trace: a list of lists, empty for good traces
+    metrics = qc_metrics(data)
+    checks = [
+        ("non-finite samples", ~metrics["finite"]),
+        ("zero variance", metrics["variance"] == 0),
+        (
+            "clipped ({:.2%} of samples at the rails)",
+            metrics["clip_fraction"] > thresholds["max_clip_fraction"],
+            metrics["clip_fraction"],
+        ),
+        (
+            "spike (ratio {:.0f})",
+            metrics["spike_ratio"] > thresholds["max_spike_ratio"],
+            metrics["spike_ratio"],
+        ),
+        (
+            "saturated ({:d} samples in a row at the rails)",
+            metrics["saturation_run"] > thresholds["max_saturation_run"],
+            metrics["saturation_run"],
+        ),
+    ]
+
+    reasons = [[] for _ in range(len(metrics["finite"]))]
+    for check in checks:
+        message, failed = check[0], check[1]
+        for i in np.flatnonzero(failed):
+            reasons[i].append(message.format(check[2][i]) if len(check) > 2 else message)
+    # A flat trace is also at its rails everywhere; report it as dead only
+    for i in np.flatnonzero(metrics["variance"] == 0):
+        reasons[i] = [reason for reason in reasons[i] if not reason.startswith(("clipped", "saturated"))]
+    return reasons
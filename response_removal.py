@@ -0,0 +1,132 @@
+###############################################################################
+# Description:
+# Batched frequency-domain instrument response removal for 2_remove_response.py
+# Same steps and results as obspy Trace.remove_response (demean, cosine taper,
+# pre_filt, water level inversion), but the evaluated response is cached per
+# channel epoch, npts and sampling interval, and equal-length traces sharing a
+# response are deconvolved together with one 2-D FFT.
+###############################################################################
+from collections import OrderedDict
+
+import numpy as np
+from obspy.core.inventory import PolynomialResponseStage
+from obspy.signal.invsim import cosine_sac_taper, cosine_taper, invert_spectrum
+from obspy.signal.util import _npts2nfft
+
+###############################################################################
+PRE_FILT = (0.5, 1.0, 20, 25)
+WATER_LEVEL = 60.0
+TAPER_FRACTION = 0.05
+
+
+def channel_response(inventory, tr):
+    # Channel epoch active at the trace start and its Response
+    # Raises like Trace.remove_response if the inventory has no match
+    inv = inventory.select(
+        network=tr.stats.network,
+        station=tr.stats.station,
+        location=tr.stats.location,
+        channel=tr.stats.channel,
+        time=tr.stats.starttime,
+    )
+    channels = [cha for net in inv for sta in net for cha in sta]
+    if not channels or channels[0].response is None:
+        raise ValueError(f"No matching response information found for {tr.id}")
+    return channels[0].start_date, channels[0].response
+
+
+def is_batchable(response):
+    # Polynomial responses are not deconvolved in the frequency domain
+    return bool(response.response_stages) and not isinstance(
+        response.response_stages[0], PolynomialResponseStage
+    )
+
+
+class ResponseCache:
+    # (seed id, epoch start, npts, dt, output, pre_filt, water_level) ->
+    # (nfft, time-domain taper, pre_filt taper * inverted response)
+    # Least recently used entries are dropped beyond maxsize
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._filters = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, response, npts, delta, output, pre_filt, water_level):
+        if key in self._filters:
+            self._filters.move_to_end(key)
+            self.hits += 1
+            return self._filters[key]
+
+        self.misses += 1
+        nfft = _npts2nfft(npts)
+        taper = cosine_taper(npts, TAPER_FRACTION, sactaper=True, halfcosine=False)
+        freq_response, freqs = response.get_evalresp_response(delta, nfft, output=output)
+        if water_level is None:
+            freq_response[0] = 0.0
+            freq_response[1:] = 1.0 / freq_response[1:]
+        else:
+            invert_spectrum(freq_response, water_level)
+        if pre_filt:
+            freq_response *= cosine_sac_taper(freqs, flimit=pre_filt)
+
+        entry = (nfft, taper, freq_response)
+        self._filters[key] = entry
+        if len(self._filters) > self.maxsize:
+            self._filters.popitem(last=False)
+        return entry
+
+
+def deconvolve_stack(data, spectral_filter, taper, nfft):
+    # data: (n_traces, npts) array; all rows share one response and dt
+    npts = data.shape[1]
+    data = np.array(data, dtype=np.float64)
+    data -= data.mean(axis=1, keepdims=True)
+    data *= taper
+    spec = np.fft.rfft(data, n=nfft, axis=1)
+    spec *= spectral_filter
+    spec[:, -1] = np.abs(spec[:, -1]) + 0.0j
+    return np.fft.irfft(spec, axis=1)[:, :npts]
+
+
+def remove_response_batch(traces, inventories, cache, output="VEL", pre_filt=PRE_FILT,
+                          water_level=WATER_LEVEL):
+    # Remove the response of all traces in place; inventories[i] belongs to
+    # traces[i]. Traces are grouped by response cache key and deconvolved one
+    # stack per group. Returns one exception (or None) per trace, so a wrong
+    # response only fails the traces using it
+    errors = [None] * len(traces)
+    groups = {}
+    for i, (tr, inv) in enumerate(zip(traces, inventories)):
+        try:
+            epoch, response = channel_response(inv, tr)
+        except Exception as e:
+            errors[i] = e
+            continue
+        if not is_batchable(response):
+            try:
+                tr.remove_response(inventory=inv, output=output, pre_filt=pre_filt,
+                                   water_level=water_level)
+            except Exception as e:
+                errors[i] = e
+            continue
+        key = (tr.id, str(epoch), tr.stats.npts, tr.stats.delta, output,
+               tuple(pre_filt or ()), water_level)
+        groups.setdefault(key, (response, []))[1].append(i)
+
+    for key, (response, members) in groups.items():
+        tr = traces[members[0]]
+        try:
+            nfft, taper, spectral_filter = cache.get(
+                key, response, tr.stats.npts, tr.stats.delta, output, pre_filt, water_level
+            )
+            stack = deconvolve_stack(
+                np.vstack([traces[i].data for i in members]), spectral_filter, taper, nfft
+            )
+        except Exception as e:
+            for i in members:
+                errors[i] = e
+            continue
+        for row, i in enumerate(members):
+            traces[i].data = stack[row]
+    return errors
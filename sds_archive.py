@@ -0,0 +1,216 @@
+###############################################################################
+# Description:
+# Continuous SDS-style archive for 1_mass_download.py --mode sds.
+# Day-long data is downloaded once per station and channel into
+#   sds/YEAR/NET/STA/CHAN.D/NET.STA.LOC.CHAN.D.YEAR.JDAY
+# and the event windows are then cut locally, in bulk, from the memory-mapped
+# day files into data/<event_dir>/, the layout 2_remove_response.py reads.
+###############################################################################
+import glob
+import io
+import os
+import struct
+from functools import lru_cache
+
+import numpy as np
+from obspy import Stream, UTCDateTime, read
+
+###############################################################################
+SDS_ROOT = "sds"
+
+
+def sds_path(root, network, station, location, channel, time):
+    time = UTCDateTime(time)
+    return os.path.join(
+        root,
+        f"{time.year}",
+        network,
+        station,
+        f"{channel}.D",
+        f"{network}.{station}.{location}.{channel}.D.{time.year}.{time.julday:03d}",
+    )
+
+
+def sds_storage(root=SDS_ROOT):
+    # mseed_storage callback for MassDownloader.download: day files go straight
+    # into the archive, and days already archived are not requested again
+    def storage(network, station, location, channel, starttime, endtime):
+        path = sds_path(root, network, station, location, channel, starttime)
+        return True if os.path.exists(path) else path
+
+    return storage
+
+
+def event_windows(catlog, pre_event_min, aft_event_min):
+    # (start, end) epoch of every event window
+    start = catlog["epoch"] - pre_event_min * 60
+    end = catlog["epoch"] + aft_event_min * 60
+    return start, end
+
+
+def event_days(catlog, pre_event_min, aft_event_min):
+    # All UTC days touched by at least one event window, as epochs of midnight
+    start, end = event_windows(catlog, pre_event_min, aft_event_min)
+    first = np.floor(start / 86400).astype(np.int64)
+    last = np.floor(end / 86400).astype(np.int64)
+    days = np.unique(np.concatenate([first, last]))
+    return days * 86400
+
+
+###############################################################################
+# MiniSEED record index on memory-mapped files
+def _sample_rate(factor, multiplier):
+    # SEED 2.4 sample rate from the fixed header factor and multiplier
+    factor = factor.astype(np.float64)
+    multiplier = multiplier.astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.select(
+            [
+                (factor > 0) & (multiplier > 0),
+                (factor > 0) & (multiplier < 0),
+                (factor < 0) & (multiplier > 0),
+                (factor < 0) & (multiplier < 0),
+            ],
+            [
+                factor * multiplier,
+                -factor / multiplier,
+                -multiplier / factor,
+                1.0 / (factor * multiplier),
+            ],
+            default=factor,
+        )
+    return rate
+
+
+def _record_length(mm, byteorder):
+    # Record length from blockette 1000 of the first record
+    n_blockettes = mm[39]
+    offset = struct.unpack(byteorder + "H", bytes(mm[46:48]))[0]
+    for _ in range(n_blockettes):
+        if offset == 0 or offset + 8 > mm.size:
+            break
+        blockette_type, next_offset = struct.unpack(byteorder + "HH", bytes(mm[offset:offset + 4]))
+        if blockette_type == 1000:
+            return 2 ** int(mm[offset + 6])
+        offset = next_offset
+    return None
+
+
+@lru_cache(maxsize=512)
+def _record_index(path, mtime):
+    # Start and end epoch of every record of a fixed record length MiniSEED
+    # file, decoded for all records at once from the memory-mapped headers.
+    # Returns None for files this fast path does not handle.
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    if mm.size < 64:
+        return None
+    year_be = struct.unpack(">H", bytes(mm[20:22]))[0]
+    byteorder = ">" if 1900 <= year_be <= 2100 else "<"
+    reclen = _record_length(mm, byteorder)
+    if reclen is None or mm.size % reclen:
+        return None
+
+    headers = mm.reshape(-1, reclen)[:, :48]
+
+    def field(start, dtype):
+        raw = np.ascontiguousarray(headers[:, start:start + np.dtype(dtype).itemsize])
+        return raw.view(np.dtype(dtype).newbyteorder(byteorder)).ravel()
+
+    year = field(20, "u2").astype(np.int64)
+    if np.any((year < 1900) | (year > 2100)):
+        return None
+    jday = field(22, "u2").astype(np.int64)
+    days = (year - 1970).astype("datetime64[Y]").astype("datetime64[D]").astype(np.int64) + jday - 1
+    start = (
+        days * 86400.0
+        + headers[:, 24] * 3600.0
+        + headers[:, 25] * 60.0
+        + headers[:, 26]
+        + field(28, "u2") * 1e-4
+    )
+    # Time correction, unless the header says it is already applied
+    applied = (headers[:, 36] & 0x02) != 0
+    start += np.where(applied, 0.0, field(40, "i4") * 1e-4)
+
+    rate = _sample_rate(field(32, "i2"), field(34, "i2"))
+    n_samples = field(30, "u2").astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        duration = np.where(rate > 0, n_samples / rate, 0.0)
+    return mm, reclen, start, start + duration
+
+
+def read_window(path, starttime, endtime):
+    # Read only the records of a day file overlapping [starttime, endtime]
+    starttime, endtime = UTCDateTime(starttime), UTCDateTime(endtime)
+    index = _record_index(path, os.path.getmtime(path))
+    if index is None:
+        return read(path, format="MSEED", starttime=starttime, endtime=endtime)
+
+    mm, reclen, rec_start, rec_end = index
+    # One second margin; the exact trim is done by ObsPy afterwards
+    selected = np.flatnonzero(
+        (rec_end >= starttime.timestamp - 1.0) & (rec_start <= endtime.timestamp + 1.0)
+    )
+    if selected.size == 0:
+        return Stream()
+    records = mm.reshape(-1, reclen)[selected]
+    st = read(io.BytesIO(records.tobytes()), format="MSEED")
+    st.trim(starttime, endtime)
+    return st
+
+
+###############################################################################
+# Bulk event cutting
+def _day_files(root, day_epoch):
+    day = UTCDateTime(day_epoch)
+    return glob.glob(os.path.join(root, f"{day.year}", "*", "*", "*.D", f"*.D.{day.year}.{day.julday:03d}"))
+
+
+def cut_events(catlog, pre_event_min, aft_event_min, root=SDS_ROOT, out_root="data",
+               minimum_length=0.90, reject_channels_with_gaps=True):
+    # Cut every event window of the catalog from the archive into
+    # out_root/<event_dir>/NET.STA.LOC.CHAN__START__END.mseed, applying the
+    # same gap and minimum length rules as the event-wise download.
+    # Returns {event_dir: number of files written}
+    start, end = event_windows(catlog, pre_event_min, aft_event_min)
+    day_of_start = np.floor(start / 86400).astype(np.int64)
+    day_of_end = np.floor(end / 86400).astype(np.int64)
+    window_length = end - start
+
+    counts = {}
+    for day in np.unique(day_of_start):
+        # Channels archived for this day; a window running past midnight also
+        # reads the next day file of the same channel
+        channel_files = {}
+        for path in _day_files(root, day * 86400):
+            channel_id = ".".join(os.path.basename(path).split(".")[:4])
+            channel_files[channel_id] = path
+
+        for i in np.flatnonzero(day_of_start == day):
+            event_dir = str(catlog["name"][i])
+            t0, t1 = UTCDateTime(start[i]), UTCDateTime(end[i])
+            os.makedirs(os.path.join(out_root, event_dir), exist_ok=True)
+            n_written = 0
+            for channel_id, path in channel_files.items():
+                st = read_window(path, t0, t1)
+                if day_of_end[i] != day:
+                    network, station, location, channel = channel_id.split(".")
+                    next_path = sds_path(root, network, station, location, channel, t1)
+                    if os.path.exists(next_path):
+                        st += read_window(next_path, t0, t1)
+                st.merge()
+                if len(st) == 0:
+                    continue
+                if reject_channels_with_gaps and (len(st) > 1 or np.ma.is_masked(st[0].data)):
+                    continue
+                tr = st[0]
+                if tr.stats.endtime - tr.stats.starttime < minimum_length * window_length[i]:
+                    continue
+                name = (
+                    f"{channel_id}__{tr.stats.starttime.strftime('%Y%m%dT%H%M%SZ')}"
+                    f"__{tr.stats.endtime.strftime('%Y%m%dT%H%M%SZ')}.mseed"
+                )
+                tr.write(os.path.join(out_root, event_dir, name), format="MSEED")
+                n_written += 1
+            counts[event_dir] = n_written
+    return counts
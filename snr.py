@@ -0,0 +1,253 @@
+###############################################################################
+# Description:
+# Signal-to-noise ratios of the 3-component SAC files (7_3c_SNR_Check.ipynb)
+# for many traces at once. Traces are loaded through memory-mapped views
+# (sac_io.read_sac_bulk) into a zero-padded float32 matrix, and the RMS of
+# every window comes from cumulative sums of the squared amplitudes, so each
+# window costs two lookups whatever its length. Windows are defined relative
+# to the o (origin), t1 (P) and t2 (S) headers:
+#   noise: [o - 5 s, o)
+#   S:     [t2, t2 + 5 s)
+#   coda:  [t2 + 0.5 (t2 - o), t2 + 0.5 (t2 - o) + 15 s)
+# For the frequency bands of the attenuation inversion, a filter bank takes
+# one real FFT per trace, applies the zero-phase Butterworth band-pass
+# responses of all bands in the frequency domain and transforms back in
+# batches of traces, so every band reuses the same spectrum.
+# The files of a directory are processed in shards by a process pool, and
+# the per event-station maximum SNR is reduced in pandas.
+###############################################################################
+import multiprocessing as mp
+import os
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from scipy import fft
+from sac_io import FNULL, read_sac_bulk
+
+###############################################################################
+NOISE_LENGTH = 5.0  # s before o
+S_LENGTH = 5.0  # s after t2
+CODA_LAPSE = 0.5  # coda start after t2, as a fraction of t2 - o
+CODA_LENGTH = 15.0  # s
+MIN_SNR = 3.0
+CHUNK_SIZE = 256  # traces per padded matrix
+SHARD_SIZE = 2000  # files per pool task
+BANDS = (1.5, 3.0, 6.0, 12.0, 18.0)  # centre frequencies, Hz
+BAND_WIDTH = 2.0 / 3.0  # pass band [fc - fc/3, fc + fc/3]
+CORNERS = 4  # Butterworth order of each band edge
+IFFT_BATCH = 32  # traces per inverse transform
+
+
+def load_traces(paths):
+    # Headers, zero-padded float32 matrix (n, max npts) and npts of the
+    # readable files; the samples are copied from memory-mapped views
+    headers, data, ok = read_sac_bulk(paths)
+    headers, data = headers[ok], [x for x, good in zip(data, ok) if good]
+    npts = np.array([len(x) for x in data], dtype=np.int64)
+    matrix = np.zeros((len(data), npts.max(initial=0)), dtype=np.float32)
+    for i, x in enumerate(data):
+        matrix[i, : len(x)] = x
+    return headers, matrix, npts, ok
+
+
+def cumulative_energy(data):
+    # Cumulative sums of squared amplitudes along the last axis, with a
+    # leading zero: the energy of samples [i, j) is c[..., j] - c[..., i]
+    energy = np.square(data, dtype=np.float64)
+    cum = np.zeros(data.shape[:-1] + (data.shape[-1] + 1,), dtype=np.float64)
+    np.cumsum(energy, axis=-1, out=cum[..., 1:])
+    return cum
+
+
+def window_samples(headers, npts):
+    # Sample index bounds [start, end) of the noise, S and coda windows of
+    # every trace, clipped to the trace. As with ObsPy traces, the times stay
+    # in the headers' float32 and the sampling rate is 1 / delta rounded to
+    # microseconds, so the windows fall on the same samples
+    b, o, t2 = (headers[name].astype(np.float32) for name in ("b", "o", "t2"))
+    rate = (1.0 / np.round(headers["delta"].astype(np.float64), 6)).astype(np.float32)
+    coda = t2 + np.float32(CODA_LAPSE) * (t2 - o)
+    windows = {
+        "noise": (o - np.float32(NOISE_LENGTH), o),
+        "s": (t2, t2 + np.float32(S_LENGTH)),
+        "coda": (coda, coda + np.float32(CODA_LENGTH)),
+    }
+    bounds = {}
+    for name, (start, end) in windows.items():
+        start = np.clip(np.trunc((start - b) * rate), 0, npts).astype(np.int64)
+        end = np.clip(np.trunc((end - b) * rate), 0, npts).astype(np.int64)
+        bounds[name] = (start, end)
+    return bounds
+
+
+def window_rms(cum, start, end):
+    # RMS of the samples [start, end) of every trace from its cumulative
+    # energy cum (n, ..., npts + 1), e.g. (n, band, npts + 1) for filtered
+    # traces; NaN for empty windows
+    shape = (-1,) + (1,) * (cum.ndim - 1)
+    energy = (
+        np.take_along_axis(cum, end.reshape(shape), axis=-1)[..., 0]
+        - np.take_along_axis(cum, start.reshape(shape), axis=-1)[..., 0]
+    )
+    length = (end - start).astype(np.float64).reshape(shape[:-1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.sqrt(np.where(length > 0, energy / length, np.nan))
+
+
+def snr_ratio(signal_rms, noise_rms):
+    # signal / noise; 0 where the noise is exactly zero
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(noise_rms != 0, signal_rms / noise_rms, 0.0)
+
+
+def band_edges(bands=BANDS, width=BAND_WIDTH):
+    # (n_band, 2) corner frequencies of bands centred on bands, width times
+    # the centre frequency wide
+    centres = np.asarray(bands, dtype=np.float64)
+    return np.stack([centres * (1 - width / 2), centres * (1 + width / 2)], axis=1)
+
+
+def band_responses(freqs, edges, delta, corners=CORNERS):
+    # (n_band, n_freq) gains of zero-phase Butterworth band-passes of order
+    # corners, as ObsPy's bandpass(zerophase=True) applies them (squared
+    # magnitude of the bilinear-transform filter, forward and backward);
+    # bands whose upper corner is above the Nyquist frequency are NaN
+    nyquist = 0.5 / delta
+
+    def warp(f):
+        return np.tan(np.pi * np.minimum(f, nyquist) * delta) / (np.pi * delta)
+
+    f = warp(np.asarray(freqs, dtype=np.float64))[None, :]
+    low, high = warp(edges[:, :1]), warp(edges[:, 1:])
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        x = (f**2 - low * high) / (f * (high - low))
+        gains = 1.0 / (1.0 + x ** (2 * corners))
+    gains[:, f[0] == 0] = 0.0
+    gains[:, ~np.isfinite(f[0])] = 0.0
+    gains[edges[:, 1] >= nyquist] = np.nan
+    return gains.astype(np.float32)
+
+
+def filter_bank(matrix, npts, delta, edges, corners=CORNERS, batch=IFFT_BATCH):
+    # Band-passed copies (n, n_band, length) of the traces of a zero-padded
+    # matrix sampled at delta, yielded batch traces at a time: one rFFT per
+    # demeaned trace, zero-padded to at least twice the length so the
+    # filters do not wrap around, and one inverse transform per batch
+    length = matrix.shape[-1]
+    inside = np.arange(length) < npts[:, None]
+    means = matrix.sum(axis=-1, dtype=np.float64) / np.maximum(npts, 1)
+    data = np.where(inside, matrix - means[:, None].astype(np.float32), 0)
+    nfft = fft.next_fast_len(2 * length, real=True)
+    spectra = fft.rfft(data, n=nfft, axis=-1)
+    gains = band_responses(fft.rfftfreq(nfft, d=delta), edges, delta, corners)
+    for start in range(0, len(matrix), batch):
+        filtered = fft.irfft(spectra[start : start + batch, None, :] * gains, n=nfft, axis=-1)
+        yield start, filtered[..., :length]
+
+
+def _read_chunks(paths):
+    # Names, headers, zero-padded matrix and npts of chunks of the readable
+    # files with o, t1, t2 and dist set
+    paths = list(paths)
+    for start in range(0, len(paths), CHUNK_SIZE):
+        chunk = paths[start : start + CHUNK_SIZE]
+        headers, matrix, npts, ok = load_traces(chunk)
+        chunk = [path for path, good in zip(chunk, ok) if good]
+        valid = np.ones(len(headers), dtype=bool)
+        for name in ("o", "t1", "t2", "dist"):
+            valid &= headers[name] != FNULL
+        names = [os.path.basename(path) for path, good in zip(chunk, valid) if good]
+        yield names, headers[valid], matrix[valid], npts[valid]
+
+
+def _snr_frame(names, headers, rms):
+    # Table of the trace metadata and the window RMS / SNR columns
+    return pd.DataFrame(
+        {
+            "Filename": names,
+            "EventStation": [".".join(name.split(".")[:-2]) for name in names],
+            "Distance": headers["dist"].astype(np.float64),
+            "t1_minus_O": (headers["t1"] - headers["o"]).astype(np.float64),
+            "t2_minus_O": (headers["t2"] - headers["o"]).astype(np.float64),
+            "Noise_RMS": rms["noise"],
+            "S_RMS": rms["s"],
+            "Coda_RMS": rms["coda"],
+            "S_SNR": snr_ratio(rms["s"], rms["noise"]),
+            "Coda_SNR": snr_ratio(rms["coda"], rms["noise"]),
+        }
+    )
+
+
+def trace_snr(paths):
+    # One row per readable SAC file with o, t1, t2 and dist set: file and
+    # event-station names, distance, P/S travel times, window RMS and SNR
+    rows = []
+    for names, headers, matrix, npts in _read_chunks(paths):
+        cum = cumulative_energy(matrix)
+        bounds = window_samples(headers, npts)
+        rms = {name: window_rms(cum, start, end) for name, (start, end) in bounds.items()}
+        rows.append(_snr_frame(names, headers, rms))
+    return pd.concat(rows, ignore_index=True) if rows else pd.DataFrame()
+
+
+def trace_band_snr(paths, bands=BANDS, width=BAND_WIDTH, corners=CORNERS):
+    # trace_snr in every frequency band: one row per file and band, with the
+    # band's centre frequency in "Frequency"
+    edges = band_edges(bands, width)
+    rows = []
+    for names, headers, matrix, npts in _read_chunks(paths):
+        bounds = window_samples(headers, npts)
+        rms = {name: np.full((len(names), len(edges)), np.nan) for name in bounds}
+        # Traces sampled at the same rate share the band responses
+        deltas = headers["delta"]
+        for delta in np.unique(deltas):
+            rows_delta = np.flatnonzero(deltas == delta)
+            sub = matrix[rows_delta, : npts[rows_delta].max()]
+            for start, filtered in filter_bank(sub, npts[rows_delta], float(delta), edges, corners):
+                batch = rows_delta[start : start + len(filtered)]
+                cum = cumulative_energy(filtered)
+                for name, (start_idx, end_idx) in bounds.items():
+                    rms[name][batch] = window_rms(cum, start_idx[batch], end_idx[batch])
+        frame = _snr_frame(
+            np.repeat(names, len(edges)), np.repeat(headers, len(edges)), {k: v.ravel() for k, v in rms.items()}
+        )
+        frame.insert(2, "Frequency", np.tile(np.asarray(bands, dtype=np.float64), len(names)))
+        rows.append(frame)
+    return pd.concat(rows, ignore_index=True) if rows else pd.DataFrame()
+
+
+def sac_files(directory):
+    # SAC files of a directory, sorted
+    with os.scandir(directory) as entries:
+        return sorted(entry.path for entry in entries if entry.is_file() and entry.name.endswith(".SAC"))
+
+
+def snr_table(directories, workers=None, shard_size=SHARD_SIZE, bands=None):
+    # trace_snr of all SAC files of one or more directories, in shards of
+    # shard_size files on a process pool; with bands (centre frequencies),
+    # trace_band_snr in each band instead
+    if isinstance(directories, str):
+        directories = [directories]
+    paths = [path for directory in directories for path in sac_files(directory)]
+    shards = [paths[i : i + shard_size] for i in range(0, len(paths), shard_size)]
+    function = trace_snr if bands is None else partial(trace_band_snr, bands=bands)
+    if len(shards) > 1 and workers != 1:
+        with mp.Pool(processes=workers) as pool:
+            tables = pool.map(function, shards)
+    else:
+        tables = [function(shard) for shard in shards]
+    tables = [table for table in tables if len(table)]
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+
+
+def select_event_stations(df, min_snr=MIN_SNR, columns=("S_SNR", "Coda_SNR")):
+    # Rows of the event-stations whose best component reaches min_snr in
+    # every column of columns, sorted by file name; band tables are
+    # selected band by band
+    if df.empty:
+        return df
+    keys = ["EventStation"] + (["Frequency"] if "Frequency" in df else [])
+    best = df.groupby(keys)[list(columns)].transform("max")
+    keep = (best >= min_snr).all(axis=1)
+    return df[keep].sort_values(["Filename"] + keys[1:]).reset_index(drop=True)
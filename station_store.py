@@ -0,0 +1,174 @@
+###############################################################################
+# Description:
+# Shared station metadata store: one StationXML per station and epoch in
+# response/stations/ instead of one copy per station per event.
+# 1_mass_download.py passes StationStore.stationxml_storage to the
+# MassDownloader so metadata already in the store is not downloaded again,
+# and 2_remove_response.py looks the responses up through the in-memory index.
+###############################################################################
+import glob
+import hashlib
+import os
+import shutil
+import threading
+
+from obspy import read_inventory
+from obspy.clients.fdsn.mass_downloader.utils import get_stationxml_contents
+
+###############################################################################
+STORE_DIR = "response/stations"
+
+
+class StationStore:
+    # Files are named NET.STA.<tag>.xml, the tag being the start of the first
+    # request that needed the file, or a content hash for imported files.
+    # The channel epochs of every file are read with the fast StationXML scan
+    # of the mass downloader; full inventories are parsed only when a response
+    # is requested, and each file only once per process.
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.RLock()
+        self._files = None  # (network, station) -> list of paths
+        self._contents = {}  # path -> list of ChannelAvailability
+        self._inventories = {}  # path -> Inventory
+
+    def _index(self):
+        with self._lock:
+            if self._files is None:
+                self._files = {}
+                for path in sorted(glob.glob(os.path.join(self.root, "*.xml"))):
+                    network, station = os.path.basename(path).split(".")[:2]
+                    self._files.setdefault((network, station), []).append(path)
+            return self._files
+
+    def station_files(self, network, station):
+        # Store files of one station, in lookup order
+        return list(self._index().get((network, station), []))
+
+    def _channel_epochs(self, path):
+        with self._lock:
+            if path not in self._contents:
+                if not os.path.exists(path):
+                    return []  # registered, download not finished (or failed)
+                self._contents[path] = get_stationxml_contents(path)
+            return self._contents[path]
+
+    def _covering_file(self, network, station, location, channel, starttime, endtime):
+        for path in self._index().get((network, station), []):
+            for epoch in self._channel_epochs(path):
+                if (
+                    epoch.location == location
+                    and epoch.channel == channel
+                    and epoch.starttime <= starttime
+                    and epoch.endtime >= endtime
+                ):
+                    return path
+        return None
+
+    def stationxml_storage(self, network, station, channels, starttime, endtime):
+        # stationxml_storage callback of MassDownloader.download: channels
+        # with an epoch covering the request are reported as available,
+        # the others are downloaded into a new file of the store
+        with self._lock:
+            available, missing, filename = [], [], None
+            for location, channel in channels:
+                path = self._covering_file(network, station, location, channel, starttime, endtime)
+                if path is None:
+                    missing.append((location, channel))
+                else:
+                    available.append((location, channel))
+                    filename = filename or path
+
+            if missing:
+                filename = os.path.join(
+                    self.root, f"{network}.{station}.{starttime.strftime('%Y%m%dT%H%M%S')}.xml"
+                )
+                # Forget an earlier, unfinished download to the same name
+                self._contents.pop(filename, None)
+                files = self._index().setdefault((network, station), [])
+                if filename not in files:
+                    files.append(filename)
+
+            return {
+                "available_channels": available,
+                "missing_channels": missing,
+                "filename": filename,
+            }
+
+    def _inventory(self, path):
+        with self._lock:
+            if path not in self._inventories:
+                self._inventories[path] = read_inventory(path)
+            return self._inventories[path]
+
+    def _active_epoch(self, network, station, location, channel, time):
+        # (path, channel epoch) active at `time`, or (None, None)
+        for path in self._index().get((network, station), []):
+            for epoch in self._channel_epochs(path):
+                if (
+                    epoch.location == location
+                    and epoch.channel == channel
+                    and epoch.starttime <= time <= epoch.endtime
+                ):
+                    return path, epoch
+        return None, None
+
+    def epoch_start(self, network, station, location, channel, time):
+        # Start of the channel epoch active at `time`, without parsing the
+        # full inventory, or None
+        with self._lock:
+            _, epoch = self._active_epoch(network, station, location, channel, time)
+            return None if epoch is None else epoch.starttime
+
+    def epoch_file(self, network, station, location, channel, time):
+        # StationXML file holding the channel epoch active at `time`, or None
+        with self._lock:
+            path, _ = self._active_epoch(network, station, location, channel, time)
+            return path
+
+    def select(self, network, station, location, channel, time):
+        # Inventory with the channel epoch active at `time`, or None
+        with self._lock:
+            path, _ = self._active_epoch(network, station, location, channel, time)
+            if path is None:
+                return None
+            return self._inventory(path).select(
+                network=network,
+                station=station,
+                location=location,
+                channel=channel,
+                time=time,
+            )
+
+    def import_event_responses(self, response_root="response"):
+        # Copy legacy per-event copies (response/<event_dir>/NET.STA.xml) into
+        # the store, keeping one file per distinct content
+        with self._lock:
+            known = set()
+            for path in glob.glob(os.path.join(self.root, "*.xml")):
+                with open(path, "rb") as f:
+                    known.add(hashlib.sha1(f.read()).hexdigest())
+
+            n_new = n_dup = 0
+            for path in sorted(glob.glob(os.path.join(response_root, "*", "*.xml"))):
+                if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.root):
+                    continue
+                with open(path, "rb") as f:
+                    digest = hashlib.sha1(f.read()).hexdigest()
+                if digest in known:
+                    n_dup += 1
+                    continue
+                network, station = os.path.basename(path).split(".")[:2]
+                shutil.copy2(path, os.path.join(self.root, f"{network}.{station}.{digest[:12]}.xml"))
+                known.add(digest)
+                n_new += 1
+
+            self._files = None
+            return n_new, n_dup
+
+
+if __name__ == "__main__":
+    # Import the per-event StationXML copies of earlier downloads
+    n_new, n_dup = StationStore().import_event_responses()
+    print(f"Imported {n_new} distinct StationXML files, skipped {n_dup} duplicates")
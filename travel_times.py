@@ -0,0 +1,112 @@
+###############################################################################
+# Description:
+# Travel-time tables for 4_3c_PS.py, replacing one `taup setsac` JVM run per
+# event directory. First-arrival P and S times are computed once with ObsPy's
+# TauPyModel on a distance x source-depth grid, cached on disk per velocity
+# model and grid, and interpolated for all traces in one vectorized call.
+# The model is a TauP built-in name (e.g. prem) or a local 1D model file
+# (.nd or .tvel), which is converted to a TauPy model next to the tables.
+###############################################################################
+import hashlib
+import multiprocessing as mp
+import os
+
+import numpy as np
+from obspy.taup import TauPyModel
+from obspy.taup.taup_create import build_taup_model
+
+###############################################################################
+TABLE_DIR = "model/traveltimes"
+DISTANCE_STEP = 0.02  # degree
+DEPTH_STEP = 2.0  # km
+MIN_MAX_DISTANCE = 2.0  # degree
+MIN_MAX_DEPTH = 40.0  # km
+
+# First arrival among all P-type or all S-type phases (p, Pg, Pn, P, ...)
+PHASES = {"P": "ttp", "S": "tts"}
+
+
+def model_source(model):
+    # TauPyModel argument and cache tag of a model name or 1D model file
+    if not os.path.isfile(model):
+        return model, model
+    with open(model, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(model))[0]
+    npz_file = os.path.join(TABLE_DIR, f"{name}.{digest}", f"{name}.npz")
+    if not os.path.exists(npz_file):
+        os.makedirs(os.path.dirname(npz_file), exist_ok=True)
+        build_taup_model(model, output_folder=os.path.dirname(npz_file), verbose=False)
+    return npz_file, f"{name}.{digest}"
+
+
+def grid_extent(max_distance, max_depth):
+    # Grid limits covering the data, rounded up so nearby data sets share
+    # one cached table
+    max_distance = max(MIN_MAX_DISTANCE, np.ceil(np.nanmax(max_distance, initial=0.0)))
+    max_depth = max(MIN_MAX_DEPTH, np.ceil(np.nanmax(max_depth, initial=0.0) / 20.0) * 20.0)
+    return float(max_distance), float(max_depth)
+
+
+def _first_arrivals(args):
+    # One grid row: first P and S times at all distances for one depth
+    taup_model, depth, distances = args
+    model = TauPyModel(model=taup_model)
+    row = np.full((len(PHASES), len(distances)), np.nan)
+    for j, distance in enumerate(distances):
+        for k, phase in enumerate(PHASES.values()):
+            arrivals = model.get_travel_times(
+                source_depth_in_km=depth, distance_in_degree=distance, phase_list=[phase]
+            )
+            if arrivals:
+                row[k, j] = min(arrival.time for arrival in arrivals)
+    return row
+
+
+class TravelTimeTable:
+    # tables[k] holds the phase PHASES[k] times on the (depth, distance) grid
+    def __init__(self, model="prem", max_distance=MIN_MAX_DISTANCE, max_depth=MIN_MAX_DEPTH, workers=None):
+        taup_model, tag = model_source(model)
+        max_distance, max_depth = grid_extent(max_distance, max_depth)
+        self.distances = np.arange(0.0, max_distance + DISTANCE_STEP / 2, DISTANCE_STEP)
+        self.depths = np.arange(0.0, max_depth + DEPTH_STEP / 2, DEPTH_STEP)
+
+        path = os.path.join(
+            TABLE_DIR, f"{tag}_{max_distance:g}deg_{DISTANCE_STEP:g}_{max_depth:g}km_{DEPTH_STEP:g}.npz"
+        )
+        if os.path.exists(path):
+            self.tables = np.load(path)["tables"]
+        else:
+            print(f"Computing {'/'.join(PHASES)} travel-time tables for {tag} "
+                  f"({len(self.depths)} depths x {len(self.distances)} distances), cached in {path}")
+            jobs = [(taup_model, depth, self.distances) for depth in self.depths]
+            with mp.Pool(processes=workers) as pool:
+                rows = pool.map(_first_arrivals, jobs)
+            self.tables = np.stack(rows, axis=1)  # (phase, depth, distance)
+            os.makedirs(TABLE_DIR, exist_ok=True)
+            np.savez(path, tables=self.tables, distances=self.distances, depths=self.depths)
+
+    def travel_times(self, distance, depth):
+        # Bilinear interpolation of all phases for arrays of distances (degree)
+        # and source depths (km); NaN outside the grid or where a phase is
+        # missing. Returns {phase: times}
+        distance = np.asarray(distance, dtype=np.float64)
+        depth = np.asarray(depth, dtype=np.float64)
+        inside = (
+            (distance >= 0) & (distance <= self.distances[-1]) & (depth >= 0) & (depth <= self.depths[-1])
+        )
+        x = np.where(inside, distance / DISTANCE_STEP, 0.0)
+        y = np.where(inside, depth / DEPTH_STEP, 0.0)
+        i = np.minimum(y.astype(np.int64), len(self.depths) - 2)
+        j = np.minimum(x.astype(np.int64), len(self.distances) - 2)
+        fy, fx = y - i, x - j
+
+        t = self.tables
+        times = (
+            t[:, i, j] * (1 - fy) * (1 - fx)
+            + t[:, i, j + 1] * (1 - fy) * fx
+            + t[:, i + 1, j] * fy * (1 - fx)
+            + t[:, i + 1, j + 1] * fy * fx
+        )
+        times[:, ~inside] = np.nan
+        return dict(zip(PHASES, times))